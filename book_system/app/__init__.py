@@ -3,12 +3,19 @@ from flask_pymongo import PyMongo
 from config import Config
 from apscheduler.schedulers.background import BackgroundScheduler
 from app.spark.word_cloud_generator import generate_word_cloud
+from app.services.storage_service import storage
 import os
 
 mongo = PyMongo()
 scheduler = BackgroundScheduler()
 
-def create_app():
+def create_app(start_scheduler: bool = True):
+    """
+    创建Flask应用
+    
+    Args:
+        start_scheduler: 是否启动定时任务，独立的分析worker进程自行回收和认领任务，不需要启动
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
     
@@ -16,6 +23,7 @@ def create_app():
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     mongo.init_app(app)
+    storage.init_app(app)
     
     # 添加定时任务
     scheduler.add_job(
@@ -25,11 +33,37 @@ def create_app():
         id='generate_word_cloud_job',
         name='Generate Word Cloud'
     )
-    scheduler.start()
+    # 定期清理过期的分块上传会话
+    from app.services.chunked_upload_service import cleanup_stale_sessions
+    scheduler.add_job(
+        func=cleanup_stale_sessions,
+        trigger='interval',
+        hours=1,
+        args=[app.config['UPLOAD_CHUNK_FOLDER'], app.config['UPLOAD_SESSION_TTL_HOURS']],
+        id='cleanup_upload_sessions_job',
+        name='Cleanup Upload Sessions'
+    )
+    # 定期回收租约过期的上传任务并调度队列，进程崩溃后任务会自动重试
+    from app.utils import run_queue_maintenance
+    scheduler.add_job(
+        func=run_queue_maintenance,
+        trigger='interval',
+        seconds=app.config['UPLOAD_REAPER_INTERVAL_SECONDS'],
+        args=[app],
+        id='upload_queue_maintenance_job',
+        name='Upload Queue Maintenance'
+    )
+    if start_scheduler:
+        scheduler.start()
 
     from app.routes import main
     app.register_blueprint(main)
     
+    from app.utils import ensure_upload_indexes
+    ensure_upload_indexes()
+    # 启动时立即恢复上次进程退出时遗留的任务
+    run_queue_maintenance(app)
+    
     # 确保导入generate_result模块
     from app.services import generate_result
     
@@ -11,7 +11,7 @@ class UploadFile:
         self.processed_records = 0
         self.total_records = 0
         self.error_message = None
-        self.queue_position = None # 队列位置
+        self.enqueue_seq = None # 入队序号，排队位置在读取时计算
     def to_dict(self):
         return {
             '_id': self._id,
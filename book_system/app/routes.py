@@ -1,16 +1,17 @@
 from flask import Blueprint, render_template, request, jsonify, current_app, copy_current_request_context
 from app import mongo
 from app.utils import (
-    get_current_time,
     format_file_size, 
-    save_file_to_hdfs, 
-    count_csv_lines_efficient,
-    process_file_async,
-    manage_upload_queue
+    format_duration,
+    enqueue_upload,
+    request_cancel,
+    purge_upload_results,
+    summarize_stage_timings,
+    get_queue_position,
+    get_queue_positions
 )
 from werkzeug.utils import secure_filename
 from app.models import UploadFile
-import os
 import logging
 from datetime import datetime
 from bson import ObjectId
@@ -18,6 +19,15 @@ from app.services.word_cloud_service import get_cached_word_cloud
 from app.services.book_word_cloud_service import get_cached_book_word_cloud
 from app.services.generate_result import generate_content 
 from app.services.upload_word_cloud_service import get_upload_word_cloud
+from app.services.csv_ingest_service import ingest_csv_stream, is_supported_upload
+from app.services.chunked_upload_service import (
+    ChunkedUploadError,
+    init_session,
+    save_chunk,
+    session_status,
+    start_merge,
+    merge_session
+)
 import uuid
 from threading import Thread
 
@@ -100,6 +110,7 @@ def upload():
     try:
         # 从uploads集合获取上传历史记录
         uploads = list(mongo.db.uploads.find().sort('upload_time', -1))
+        queue_positions = get_queue_positions(uploads)
         
         # 格式化数据
         formatted_uploads = []
@@ -108,7 +119,7 @@ def upload():
                 'filename': upload.get('filename', ''),
                 'size': format_file_size(upload.get('size', 0)),
                 'status': upload.get('status', 'pending'),
-                'queue_position': upload.get('queue_position'),
+                'queue_position': queue_positions.get(upload['_id']),
                 'upload_time': upload.get('upload_time', '').strftime('%Y-%m-%d %H:%M:%S') if upload.get('upload_time') else '-',
                 'last_updated': upload.get('last_updated', '').strftime('%Y-%m-%d %H:%M:%S') if upload.get('last_updated') else '-',
                 'processed_records': upload.get('processed_records', '-'),
@@ -134,6 +145,7 @@ def get_session_upload_history():
         
         # 只获取当前会话上传的文件记录
         uploads = list(mongo.db.uploads.find({'_id': {'$in': object_ids}}).sort('upload_time', -1))
+        queue_positions = get_queue_positions(uploads)
         
         # 格式化数据
         formatted_uploads = []
@@ -143,9 +155,14 @@ def get_session_upload_history():
                 'filename': upload.get('filename', ''),
                 'size': format_file_size(upload.get('size', 0)),
                 'status': upload.get('status', 'pending'),
-                'queue_position': upload.get('queue_position'),
+                'queue_position': queue_positions.get(upload['_id']),
                 'upload_time': upload.get('upload_time', '').strftime('%Y-%m-%d %H:%M:%S') if upload.get('upload_time') else '-',
                 'last_updated': upload.get('last_updated', '').strftime('%Y-%m-%d %H:%M:%S') if upload.get('last_updated') else '-',
+                'processed_records': upload.get('processed_records', 0),
+                'analysis_records': upload.get('analysis_records'),
+                'throughput': upload.get('throughput'),
+                'eta': format_duration(upload.get('eta_seconds')),
+                'cancel_requested': upload.get('cancel_requested', False),
                 'total_records': upload.get('total_records', '-'),
                 'error_message': upload.get('error_message', '-')
             }
@@ -163,10 +180,20 @@ def get_session_upload_history():
             'msg': f"获取上传历史失败: {str(e)}"
         })
 
+def _enqueue_response(queued):
+    """根据入队结果生成上传接口的返回数据"""
+    msg = '文件内容与已处理的文件相同，已直接复用处理结果' if queued['duplicate_of'] else '文件已上传并加入处理队列'
+    return {
+        'code': 0, 
+        'msg': msg,
+        'file_id': queued['file_id'],
+        'queue_position': queued['queue_position'],
+        'duplicate_of': queued['duplicate_of']
+    }
+
 @main.route('/api/upload', methods=['POST'])
 def upload_file():
     """处理文件上传"""
-    temp_path = None
     try:
         if 'file' not in request.files:
             return jsonify({'code': 1, 'msg': '没有文件被上传'})
@@ -175,110 +202,120 @@ def upload_file():
         if file.filename == '':
             return jsonify({'code': 1, 'msg': '没有选择文件'})
             
-        if not file.filename.endswith('.csv'):
-            return jsonify({'code': 1, 'msg': '只支持CSV文件'})
+        if not is_supported_upload(file.filename):
+            return jsonify({'code': 1, 'msg': '只支持CSV文件(.csv, .csv.gz, .csv.zst)'})
             
         # 生成安全的文件名
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        # 保存文件到临时目录
-        file.save(temp_path)
-        logger.info(f"文件已保存到临时目录: {temp_path}")
         
-        # 处理可能的book_id冲突
+        # 单遍流式解压、校验CSV、处理book_id冲突并压缩写入HDFS
         try:
-            import pandas as pd
-            
-            # 读取CSV文件
-            logger.info("开始读取CSV文件...")
-            df = pd.read_csv(temp_path)
-            logger.info(f"成功读取CSV文件，列名: {df.columns.tolist()}")
-            
-            if 'book_id' not in df.columns or 'book_title' not in df.columns:
-                raise Exception("CSV文件必须包含 book_id 和 book_title 列")
-            
-            # 检查每个book_id是否存在冲突
-            modified = False
-            unique_book_ids = df['book_id'].unique()
-            logger.info(f"开始检查 {len(unique_book_ids)} 个唯一book_id")
-            
-            for book_id in unique_book_ids:
-                existing_book = mongo.db.books_info.find_one({'book_id': str(book_id)})
-                if existing_book:
-                    logger.info(f"找到已存在的book_id: {book_id}")
-                    current_title = df[df['book_id'] == book_id]['book_title'].iloc[0]
-                    if existing_book['book_title'] != current_title:
-                        new_book_id = str(book_id) + '9'
-                        df.loc[df['book_id'] == book_id, 'book_id'] = new_book_id
-                        modified = True
-                        logger.info(f"检测到book_id冲突，将{book_id}修改为{new_book_id}")
-                        logger.info(f"原书名: {existing_book['book_title']}, 新书名: {current_title}")
-            
-            if modified:
-                # 如果有修改，保存更新后的文件
-                logger.info("检测到修改，正在保存更新后的文件...")
-                df.to_csv(temp_path, index=False)
-                logger.info("已更新文件中的重复book_id")
-            else:
-                logger.info("未检测到需要修改的book_id")
-            
-            # 获取文件大小和总记录数
-            file_size = os.path.getsize(temp_path)
-            total_records = len(df)
-            book_ids = [str(book_id) for book_id in df['book_id'].unique()]
-            logger.info(f"文件大小: {file_size}, 总记录数: {total_records}")
-            
+            logger.info(f"开始流式导入文件: {filename}")
+            ingest_result = ingest_csv_stream(
+                file.stream,
+                filename,
+                current_app.config['CSV_CHUNK_SIZE']
+            )
         except Exception as e:
             logger.error(f"处理CSV文件失败: {str(e)}", exc_info=True)
             return jsonify({'code': 1, 'msg': f'处理CSV文件失败: {str(e)}'})
         
-        # 获取当前队列位置
-        queue_position = mongo.db.uploads.count_documents({'status': 'queued'}) + 1
-        
-        # 创建上传记录
-        file_id = ObjectId()
-        upload_record = {
-            '_id': file_id,
-            'filename': filename,
-            'size': int(file_size),
-            'upload_time': get_current_time(),
-            'status': 'queued',
-            'processed_records': 0,
-            'total_records': total_records,
-            'book_ids': book_ids,
-            'last_updated': get_current_time(),
-            'queue_position': queue_position
-        }
-        
-        mongo.db.uploads.insert_one(upload_record)
-        logger.info(f"已创建上传记录: {file_id}")
-        
-        # 保存到HDFS并启动异步处理
-        if save_file_to_hdfs(temp_path, filename):
-            # 管理上传队列
-            manage_upload_queue()
-            return jsonify({
-                'code': 0, 
-                'msg': '文件已上传并加入处理队列',
-                'file_id': str(file_id),
-                'queue_position': queue_position
-            })
-        else:
-            mongo.db.uploads.delete_one({'_id': file_id})
-            return jsonify({'code': 1, 'msg': '上传到HDFS失败'})
+        queued = enqueue_upload(filename, ingest_result)
+        return jsonify(_enqueue_response(queued))
             
     except Exception as e:
         logger.error(f"文件上传失败: {str(e)}", exc_info=True)
         return jsonify({'code': 1, 'msg': f'文件上传失败: {str(e)}'})
-    finally:
-        # 清理临时文件
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                logger.info(f"已清理临时文件: {temp_path}")
-            except Exception as e:
-                logger.error(f"删除临时文件失败: {str(e)}")
+
+@main.route('/api/upload/chunked/init', methods=['POST'])
+def init_chunked_upload():
+    """初始化分块上传会话，用于超过单次请求大小限制的文件"""
+    try:
+        data = request.get_json() or {}
+        filename = secure_filename(data.get('filename', ''))
+        if not filename:
+            return jsonify({'code': 1, 'msg': '没有选择文件'})
+            
+        if not is_supported_upload(filename):
+            return jsonify({'code': 1, 'msg': '只支持CSV文件(.csv, .csv.gz, .csv.zst)'})
+        
+        session = init_session(
+            filename,
+            int(data.get('size', 0)),
+            int(data.get('chunk_size', current_app.config['UPLOAD_CHUNK_SIZE'])),
+            data.get('checksum'),
+            current_app.config['UPLOAD_CHUNK_SIZE'],
+            current_app.config['MAX_CHUNKED_UPLOAD_SIZE']
+        )
+        return jsonify({'code': 0, 'data': session})
+        
+    except (ChunkedUploadError, ValueError) as e:
+        return jsonify({'code': 1, 'msg': str(e)})
+    except Exception as e:
+        logger.error(f"初始化分块上传失败: {str(e)}", exc_info=True)
+        return jsonify({'code': 1, 'msg': f'初始化分块上传失败: {str(e)}'})
+
+@main.route('/api/upload/chunked/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """获取分块上传会话状态，返回尚未收到的分块"""
+    try:
+        return jsonify({'code': 0, 'data': session_status(upload_id)})
+    except ChunkedUploadError as e:
+        return jsonify({'code': 1, 'msg': str(e)})
+    except Exception as e:
+        logger.error(f"获取分块上传状态失败: {str(e)}")
+        return jsonify({'code': 1, 'msg': f'获取分块上传状态失败: {str(e)}'})
+
+@main.route('/api/upload/chunked/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """上传单个分块，请求体为分块的原始字节"""
+    try:
+        session = save_chunk(
+            upload_id,
+            index,
+            request.stream,
+            request.headers.get('X-Chunk-Checksum'),
+            current_app.config['UPLOAD_CHUNK_FOLDER']
+        )
+        return jsonify({'code': 0, 'data': session})
+    except ChunkedUploadError as e:
+        return jsonify({'code': 1, 'msg': str(e)})
+    except Exception as e:
+        logger.error(f"保存分块失败: {str(e)}", exc_info=True)
+        return jsonify({'code': 1, 'msg': f'保存分块失败: {str(e)}'})
+
+@main.route('/api/upload/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """
+    在后台合并分块、校验并加入处理队列
+    
+    大文件的合并和导入耗时较长，接口立即返回202，客户端通过会话状态接口查询导入结果。
+    """
+    try:
+        try:
+            session = start_merge(upload_id)
+        except ChunkedUploadError as e:
+            return jsonify({'code': 1, 'msg': str(e)})
+        
+        app = current_app._get_current_object()
+        
+        def merge_async():
+            with app.app_context():
+                merge_session(session, app.config['UPLOAD_CHUNK_FOLDER'], app.config['CSV_CHUNK_SIZE'])
+        
+        thread = Thread(target=merge_async)
+        thread.daemon = True
+        thread.start()
+        
+        return jsonify({
+            'code': 0,
+            'msg': '分块已全部接收，正在合并导入',
+            'data': {'upload_id': upload_id, 'status': 'merging'}
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"文件上传失败: {str(e)}", exc_info=True)
+        return jsonify({'code': 1, 'msg': f'文件上传失败: {str(e)}'})
 
 @main.route('/upload/details/<file_id>')
 def upload_details(file_id):
@@ -290,8 +327,12 @@ def upload_details(file_id):
         
         # 格式化文件信息
         upload['size'] = format_file_size(upload['size'])
+        if upload.get('stored_size') is not None:
+            upload['stored_size'] = format_file_size(upload['stored_size'])
         if 'upload_time' in upload:
             upload['upload_time'] = upload['upload_time'].strftime('%Y-%m-%d %H:%M:%S')
+        upload['queue_position'] = get_queue_position(upload)
+        upload['eta'] = format_duration(upload.get('eta_seconds'))
         
         # 获取相关书籍信息
         book_ids = upload.get('book_ids', [])
@@ -302,6 +343,7 @@ def upload_details(file_id):
         
         return render_template('upload_details.html',
                              upload=upload,
+                             stage_timings=summarize_stage_timings(upload.get('stage_timings')),
                              books=books,
                              word_cloud_data=word_cloud_data)
                              
@@ -318,8 +360,17 @@ def delete_upload(file_id):
         if not upload:
             return jsonify({'code': 1, 'msg': '文件不存在'})
             
-        # 获取相关的book_ids
-        book_ids = upload.get('book_ids', [])
+        # 未结束的任务先取消；处理中的任务由worker停止作业并清理结果后删除记录
+        if upload['status'] in ('queued', 'processing'):
+            cancel_state = request_cancel(file_id, delete=True)
+            if cancel_state == 'cancelling':
+                return jsonify({
+                    'code': 0,
+                    'msg': '任务正在取消，取消完成后将自动删除',
+                    'data': {'deleted_books': 0}
+                })
+            if cancel_state == 'cancelled':
+                upload['status'] = 'cancelled'
         
         # 开始删除操作
         with mongo.cx.start_session() as session:
@@ -327,18 +378,15 @@ def delete_upload(file_id):
                 # 删除上传记录
                 mongo.db.uploads.delete_one({'_id': ObjectId(file_id)})
                 
-                # 删除相关的books_info记录
-                if book_ids:
-                    mongo.db.books_info.delete_many({'book_id': {'$in': book_ids}})
-                    
-                    # 删除相关的评论记录
-                    mongo.db.comments_tags.delete_many({'book_id': {'$in': book_ids}})
+                # 只删除这次上传写入的评论和新建的书籍；排队中被取消的任务尚未写入任何数据，
+                # 其他相同内容的上传仍在使用这些结果时只删除上传记录
+                deleted_books = 0 if upload['status'] == 'cancelled' else purge_upload_results(upload)
                 
         return jsonify({
             'code': 0, 
             'msg': '删除成功',
             'data': {
-                'deleted_books': len(book_ids)
+                'deleted_books': deleted_books
             }
         })
         
@@ -346,6 +394,24 @@ def delete_upload(file_id):
         logger.error(f"删除文件失败: {str(e)}")
         return jsonify({'code': 1, 'msg': f'删除失败: {str(e)}'})
 
+@main.route('/api/upload/<file_id>/cancel', methods=['POST'])
+def cancel_upload(file_id):
+    """取消排队中或处理中的上传任务"""
+    try:
+        if not ObjectId.is_valid(file_id):
+            return jsonify({'code': 1, 'msg': '文件不存在'})
+        
+        cancel_state = request_cancel(file_id)
+        if cancel_state == 'cancelled':
+            return jsonify({'code': 0, 'msg': '任务已取消', 'data': {'status': 'cancelled'}})
+        if cancel_state == 'cancelling':
+            return jsonify({'code': 0, 'msg': '正在取消任务，已写入的结果将被清理', 'data': {'status': 'cancelling'}})
+        return jsonify({'code': 1, 'msg': '任务已结束，无法取消'})
+        
+    except Exception as e:
+        logger.error(f"取消任务失败: {str(e)}")
+        return jsonify({'code': 1, 'msg': f'取消失败: {str(e)}'})
+
 @main.route('/book/detail')
 def book_detail():
     book_id = request.args.get('id')
@@ -0,0 +1,325 @@
+import os
+import shutil
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, BinaryIO
+from bson import ObjectId
+from app import mongo
+from app.services.csv_ingest_service import ingest_csv_stream
+from app.services.storage_service import storage
+from app.utils import get_current_time, enqueue_upload
+
+logger = logging.getLogger(__name__)
+
+# 写入分块时每次读取的字节数
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkedUploadError(Exception):
+    """分块上传请求不合法"""
+
+
+def _chunk_dir(chunk_folder: str, upload_id: str) -> str:
+    return os.path.join(chunk_folder, upload_id)
+
+
+def _chunk_path(chunk_folder: str, upload_id: str, index: int) -> str:
+    return os.path.join(_chunk_dir(chunk_folder, upload_id), f"{index:06d}.part")
+
+
+def _get_session(upload_id: str) -> Dict[str, Any]:
+    if not ObjectId.is_valid(upload_id):
+        raise ChunkedUploadError("上传会话ID无效")
+    session = mongo.db.upload_sessions.find_one({'_id': ObjectId(upload_id)})
+    if not session:
+        raise ChunkedUploadError("上传会话不存在或已过期")
+    return session
+
+
+def missing_chunks(session: Dict[str, Any]) -> List[int]:
+    """返回会话中尚未收到的分块序号"""
+    received = set(session.get('received_chunks', []))
+    return [index for index in range(session['total_chunks']) if index not in received]
+
+
+def session_status(upload_id: str) -> Dict[str, Any]:
+    """
+    获取分块上传会话的状态，客户端断线重连后据此只补传缺失的分块
+
+    Args:
+        upload_id: 上传会话ID
+
+    Returns:
+        Dict[str, Any]: 会话状态
+    """
+    session = _get_session(upload_id)
+    return {
+        'upload_id': upload_id,
+        'filename': session['filename'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': session['total_chunks'],
+        'status': session['status'],
+        'missing_chunks': missing_chunks(session),
+        'error_message': session.get('error_message'),
+        'result': session.get('result')
+    }
+
+
+def init_session(filename: str, size: int, chunk_size: int, checksum: Optional[str],
+                 max_chunk_size: int, max_size: int) -> Dict[str, Any]:
+    """
+    创建分块上传会话
+
+    Args:
+        filename: 安全处理后的文件名
+        size: 文件总字节数
+        chunk_size: 客户端使用的分块字节数
+        checksum: 整个文件的SHA-256(可选)，合并时校验
+        max_chunk_size: 允许的最大分块字节数
+        max_size: 允许的最大文件字节数
+
+    Returns:
+        Dict[str, Any]: 会话状态
+    """
+    if size <= 0 or size > max_size:
+        raise ChunkedUploadError(f"文件大小必须在 1 到 {max_size} 字节之间")
+    if chunk_size <= 0 or chunk_size > max_chunk_size:
+        raise ChunkedUploadError(f"分块大小必须在 1 到 {max_chunk_size} 字节之间")
+
+    upload_id = ObjectId()
+    session = {
+        '_id': upload_id,
+        'filename': filename,
+        'size': size,
+        'chunk_size': chunk_size,
+        'total_chunks': (size + chunk_size - 1) // chunk_size,
+        'checksum': checksum.lower() if checksum else None,
+        'received_chunks': [],
+        'status': 'uploading',
+        'created_at': get_current_time(),
+        'last_updated': get_current_time()
+    }
+    mongo.db.upload_sessions.insert_one(session)
+    logger.info(f"已创建分块上传会话: {upload_id}, 文件: {filename}, 分块数: {session['total_chunks']}")
+    return session_status(str(upload_id))
+
+
+def save_chunk(upload_id: str, index: int, stream: BinaryIO, chunk_checksum: Optional[str],
+               chunk_folder: str) -> Dict[str, Any]:
+    """
+    保存一个分块，重复上传同一分块会覆盖之前的内容
+
+    Args:
+        upload_id: 上传会话ID
+        index: 分块序号(从0开始)
+        stream: 分块数据流
+        chunk_checksum: 分块的SHA-256(可选)
+        chunk_folder: 分块暂存目录
+
+    Returns:
+        Dict[str, Any]: 会话状态
+    """
+    session = _get_session(upload_id)
+    if session['status'] != 'uploading':
+        raise ChunkedUploadError("上传会话已完成")
+    if index < 0 or index >= session['total_chunks']:
+        raise ChunkedUploadError(f"分块序号超出范围: {index}")
+
+    if index == session['total_chunks'] - 1:
+        expected_size = session['size'] - index * session['chunk_size']
+    else:
+        expected_size = session['chunk_size']
+
+    target = _chunk_path(chunk_folder, upload_id, index)
+    temp_path = f"{target}.tmp"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(temp_path, 'wb') as output:
+            while True:
+                data = stream.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                if written > expected_size:
+                    raise ChunkedUploadError(f"分块 {index} 大小超出预期: {expected_size}")
+                digest.update(data)
+                output.write(data)
+
+        if written != expected_size:
+            raise ChunkedUploadError(f"分块 {index} 大小不正确: 期望 {expected_size}, 实际 {written}")
+        if chunk_checksum and digest.hexdigest() != chunk_checksum.lower():
+            raise ChunkedUploadError(f"分块 {index} 校验和不匹配")
+
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    mongo.db.upload_sessions.update_one(
+        {'_id': session['_id']},
+        {
+            '$addToSet': {'received_chunks': index},
+            '$set': {'last_updated': get_current_time()}
+        }
+    )
+    return session_status(upload_id)
+
+
+class ChunkReader:
+    """按顺序读取所有分块的只读流"""
+
+    def __init__(self, paths: List[str]):
+        self._paths = list(paths)
+        self._current = None
+
+    def read(self, size: int = -1) -> bytes:
+        buffers = []
+        while size < 0 or size > 0:
+            if self._current is None:
+                if not self._paths:
+                    break
+                self._current = open(self._paths.pop(0), 'rb')
+            data = self._current.read(size)
+            if not data:
+                self._current.close()
+                self._current = None
+                continue
+            buffers.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(buffers)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        self._paths = []
+
+
+def start_merge(upload_id: str) -> Dict[str, Any]:
+    """
+    检查分块是否齐全，并将会话切换为合并中
+
+    合并和导入耗时较长，由 merge_session 在后台完成，调用方通过 session_status 查询结果。
+
+    Args:
+        upload_id: 上传会话ID
+
+    Returns:
+        Dict[str, Any]: 切换前的会话记录
+    """
+    session = _get_session(upload_id)
+    missing = missing_chunks(session)
+    if missing:
+        raise ChunkedUploadError(f"还有 {len(missing)} 个分块未上传")
+
+    # 原子地将会话切换为合并中，避免重复提交导致同一文件被导入两次
+    session = mongo.db.upload_sessions.find_one_and_update(
+        {'_id': session['_id'], 'status': 'uploading'},
+        {
+            '$set': {'status': 'merging', 'last_updated': get_current_time()},
+            '$unset': {'error_message': ''}
+        }
+    )
+    if not session:
+        raise ChunkedUploadError("上传会话已完成或正在合并")
+    return session
+
+
+def merge_session(session: Dict[str, Any], chunk_folder: str, csv_chunk_size: int) -> bool:
+    """
+    合并分块、导入并加入处理队列，在后台线程中运行
+
+    分块按顺序直接流入与普通上传相同的导入流程(校验、book_id重编号、写入HDFS)，
+    导入时同步计算整个文件的SHA-256，与初始化时提供的校验和比对。
+    结果写回会话记录：成功时状态为 completed 并附带入队结果；校验和不匹配或存储出错时
+    回到 uploading 并记录 error_message，客户端可以补传后重试；文件内容不合法时为 failed。
+
+    Args:
+        session: start_merge 返回的会话记录
+        chunk_folder: 分块暂存目录
+        csv_chunk_size: CSV分块读取的行数
+
+    Returns:
+        bool: 是否导入成功
+    """
+    upload_id = str(session['_id'])
+    paths = [_chunk_path(chunk_folder, upload_id, index) for index in range(session['total_chunks'])]
+    reader = ChunkReader(paths)
+    try:
+        try:
+            ingest_result = ingest_csv_stream(reader, session['filename'], csv_chunk_size)
+            checksum = ingest_result['checksum']
+        finally:
+            reader.close()
+
+        if session.get('checksum') and checksum != session['checksum']:
+            storage.delete(ingest_result['stored_filename'])
+            # 无法判断是哪个分块损坏，清空已收到的分块，客户端恢复会话时会重新上传所有分块
+            shutil.rmtree(_chunk_dir(chunk_folder, upload_id), ignore_errors=True)
+            mongo.db.upload_sessions.update_one(
+                {'_id': session['_id']},
+                {'$set': {'received_chunks': []}}
+            )
+            raise ChunkedUploadError("文件校验和不匹配，请重新上传")
+
+        queued = enqueue_upload(session['filename'], ingest_result)
+
+    except Exception as e:
+        # 内容不合法时重试也不会成功，直接标记失败
+        status = 'failed' if isinstance(e, ValueError) else 'uploading'
+        logger.error(f"分块上传会话 {upload_id} 合并导入失败: {str(e)}")
+        mongo.db.upload_sessions.update_one(
+            {'_id': session['_id']},
+            {'$set': {'status': status, 'error_message': str(e), 'last_updated': get_current_time()}}
+        )
+        if status == 'failed':
+            shutil.rmtree(_chunk_dir(chunk_folder, upload_id), ignore_errors=True)
+        return False
+
+    mongo.db.upload_sessions.update_one(
+        {'_id': session['_id']},
+        {'$set': {
+            'status': 'completed',
+            'checksum': checksum,
+            'result': queued,
+            'last_updated': get_current_time()
+        }}
+    )
+    shutil.rmtree(_chunk_dir(chunk_folder, upload_id), ignore_errors=True)
+    logger.info(f"分块上传会话 {upload_id} 已合并完成，SHA-256: {checksum}")
+    return True
+
+
+def cleanup_stale_sessions(chunk_folder: str, ttl_hours: int) -> int:
+    """
+    清理超时未完成的分块上传会话及其暂存分块
+
+    Args:
+        chunk_folder: 分块暂存目录
+        ttl_hours: 会话最后一次更新后保留的小时数
+
+    Returns:
+        int: 清理的会话数
+    """
+    try:
+        stale_sessions = list(mongo.db.upload_sessions.find(
+            {'last_updated': {'$lt': get_current_time() - timedelta(hours=ttl_hours)}},
+            {'_id': 1}
+        ))
+        for session in stale_sessions:
+            shutil.rmtree(_chunk_dir(chunk_folder, str(session['_id'])), ignore_errors=True)
+            mongo.db.upload_sessions.delete_one({'_id': session['_id']})
+
+        if stale_sessions:
+            logger.info(f"已清理 {len(stale_sessions)} 个过期的分块上传会话")
+        return len(stale_sessions)
+
+    except Exception as e:
+        logger.error(f"清理分块上传会话时发生错误: {str(e)}")
+        return 0
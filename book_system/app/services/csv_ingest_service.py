@@ -0,0 +1,372 @@
+import codecs
+import gzip
+import hashlib
+import logging
+import time
+import uuid
+from typing import Dict, Any, BinaryIO, Set, Tuple
+import pandas as pd
+from app import mongo
+from app.services.storage_service import storage
+
+logger = logging.getLogger(__name__)
+
+# 上传文件校验所需的列
+REQUIRED_COLUMNS = ['book_id', 'book_title']
+
+# 计算内容哈希时每次读取的字节数
+READ_BUFFER_SIZE = 1024 * 1024
+
+# 支持的上传文件后缀及对应的压缩格式
+SUPPORTED_EXTENSIONS = {
+    '.csv': None,
+    '.csv.gz': 'gzip',
+    '.csv.zst': 'zstd'
+}
+
+# 上传文件不是UTF-8编码时使用的编码，GB18030兼容GBK和GB2312
+FALLBACK_ENCODING = 'gb18030'
+
+# 存储到HDFS时使用的gzip压缩级别，Spark可以直接读取.gz文件
+STORAGE_COMPRESSLEVEL = 6
+
+
+def get_compression(filename: str):
+    """
+    根据文件名后缀判断压缩格式
+
+    Args:
+        filename: 上传文件名
+
+    Returns:
+        压缩格式('gzip'/'zstd')，未压缩时为None
+
+    Raises:
+        ValueError: 不支持的文件类型
+    """
+    lower_name = filename.lower()
+    for extension, compression in SUPPORTED_EXTENSIONS.items():
+        if lower_name.endswith(extension):
+            return compression
+    raise ValueError("只支持CSV文件(.csv, .csv.gz, .csv.zst)")
+
+
+def is_supported_upload(filename: str) -> bool:
+    """检查文件名是否为支持的上传格式"""
+    try:
+        get_compression(filename)
+        return True
+    except ValueError:
+        return False
+
+
+def get_stored_filename(filename: str) -> str:
+    """
+    获取文件在HDFS中的存储名，统一以gzip压缩保存
+
+    存储名带有随机后缀，同名文件并发处理时不会互相覆盖或被对方的清理步骤删除。
+    """
+    base_name = filename
+    lower_name = filename.lower()
+    for extension in SUPPORTED_EXTENSIONS:
+        if lower_name.endswith(extension):
+            base_name = filename[:-len(extension)]
+            break
+    return f"{base_name}_{uuid.uuid4().hex[:8]}.csv.gz"
+
+
+def open_decompressed(stream: BinaryIO, compression) -> BinaryIO:
+    """
+    返回流式解压后的数据流
+
+    Args:
+        stream: 原始二进制流
+        compression: 压缩格式('gzip'/'zstd')，None表示未压缩
+
+    Returns:
+        BinaryIO: 解压后的数据流
+    """
+    if compression is None:
+        return stream
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("服务器未安装zstandard，暂不支持.zst文件")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise ValueError(f"不支持的压缩格式: {compression}")
+
+
+def resolve_book_id_conflicts(book_titles: Dict[str, str]) -> Tuple[Dict[str, str], Set[str]]:
+    """
+    批量检查book_id冲突
+
+    用一次 $in 查询取回所有已存在的书籍，在内存中比对书名，
+    书名不同的book_id追加后缀'9'生成新的book_id，书名相同的book_id直接复用已有的书籍。
+
+    Args:
+        book_titles: book_id到上传文件中书名的映射
+
+    Returns:
+        Tuple[Dict[str, str], Set[str]]: (需要修改的旧book_id到新book_id的映射, 复用已有书籍的book_id)
+    """
+    if not book_titles:
+        return {}, set()
+
+    existing_books = mongo.db.books_info.find(
+        {'book_id': {'$in': list(book_titles)}},
+        {'_id': 0, 'book_id': 1, 'book_title': 1}
+    )
+
+    id_mapping = {}
+    reused_book_ids = set()
+    for existing_book in existing_books:
+        book_id = existing_book['book_id']
+        if book_id in id_mapping or book_id in reused_book_ids:
+            continue
+        current_title = book_titles[book_id]
+        if existing_book.get('book_title') == current_title:
+            reused_book_ids.add(book_id)
+        else:
+            id_mapping[book_id] = book_id + '9'
+            logger.info(f"检测到book_id冲突，将{book_id}修改为{id_mapping[book_id]}")
+            logger.info(f"原书名: {existing_book.get('book_title')}, 新书名: {current_title}")
+
+    logger.info(
+        f"共检查 {len(book_titles)} 个唯一book_id，其中 {len(id_mapping)} 个需要修改，"
+        f"{len(reused_book_ids)} 个复用已有书籍"
+    )
+    return id_mapping, reused_book_ids
+
+
+class BookIdResolver:
+    """
+    增量式book_id冲突解析器
+
+    每个分块只对首次出现的book_id做一次批量查询，已解析的结果会被记住，
+    因此整个文件的查询次数与分块数相关，而与书籍数量无关。
+    """
+
+    def __init__(self):
+        self.book_titles = {}
+        self.id_mapping = {}
+        self.reused_book_ids = set()
+
+    def resolve(self, chunk: pd.DataFrame) -> Dict[str, str]:
+        """
+        解析一个分块中的book_id冲突
+
+        Args:
+            chunk: 包含 book_id 和 book_title 列的分块
+
+        Returns:
+            Dict[str, str]: 截至当前分块的完整冲突映射
+        """
+        first_rows = chunk[chunk['book_id'] != ''].drop_duplicates('book_id')
+        new_titles = {
+            book_id: book_title
+            for book_id, book_title in zip(first_rows['book_id'], first_rows['book_title'])
+            if book_id not in self.book_titles
+        }
+        if new_titles:
+            self.book_titles.update(new_titles)
+            id_mapping, reused_book_ids = resolve_book_id_conflicts(new_titles)
+            self.id_mapping.update(id_mapping)
+            self.reused_book_ids.update(reused_book_ids)
+        return self.id_mapping
+
+    @property
+    def book_ids(self):
+        return [self.id_mapping.get(book_id, book_id) for book_id in self.book_titles]
+
+    @property
+    def created_book_ids(self):
+        """导入时尚不存在、由本次上传新建的book_id(包括重编号后的book_id)"""
+        return [book_id for book_id in self.book_ids if book_id not in self.reused_book_ids]
+
+
+class HashingReader:
+    """包装二进制流，读取的同时计算内容的SHA-256"""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def __iter__(self):
+        # pandas 通过是否可迭代判断类文件对象，实际读取只使用 read()
+        return iter(lambda: self.read(READ_BUFFER_SIZE), b'')
+
+    def hexdigest(self) -> str:
+        # 读取剩余数据，确保哈希覆盖整个文件
+        while self.read(READ_BUFFER_SIZE):
+            pass
+        return self._digest.hexdigest()
+
+
+class DecodingReader:
+    """
+    把二进制流增量解码为文本供 pandas 读取，在同一遍读取中识别文件编码
+
+    默认按UTF-8(兼容BOM)解码；如果在出现任何非ASCII字符之前遇到不是UTF-8的字节，
+    则改用GB18030继续解码。此前解码出的内容都是ASCII，在两种编码下完全相同。
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._ascii_only = True
+        self.encoding = 'utf-8'
+
+    def read(self, size: int = -1) -> str:
+        data = self._stream.read(size)
+        # 解码器中可能缓存着上一块末尾不完整的多字节字符，切换编码时需要一并重新解码
+        pending, _ = self._decoder.getstate()
+        try:
+            text = self._decoder.decode(data, final=not data)
+        except UnicodeDecodeError:
+            if self.encoding != 'utf-8' or not self._ascii_only:
+                raise ValueError("无法识别文件编码，请使用UTF-8或GBK编码的CSV文件")
+            logger.info(f"文件不是UTF-8编码，改用{FALLBACK_ENCODING}解码")
+            self.encoding = FALLBACK_ENCODING
+            self._decoder = codecs.getincrementaldecoder(FALLBACK_ENCODING)()
+            try:
+                text = self._decoder.decode(pending + data, final=not data)
+            except UnicodeDecodeError:
+                raise ValueError("无法识别文件编码，请使用UTF-8或GBK编码的CSV文件")
+        if self._ascii_only and not text.isascii():
+            self._ascii_only = False
+        return text
+
+    def readable(self) -> bool:
+        return True
+
+    def __iter__(self):
+        return iter(lambda: self.read(READ_BUFFER_SIZE), '')
+
+
+class CountingWriter:
+    """包装二进制写入流，统计实际写入的字节数和写入存储所花的时间"""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self.size = 0
+        self.write_seconds = 0.0
+
+    def write(self, data: bytes) -> int:
+        start_time = time.time()
+        self._stream.write(data)
+        self.write_seconds += time.time() - start_time
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def ingest_csv_stream(stream: BinaryIO, filename: str, chunk_size: int = 10000) -> Dict[str, Any]:
+    """
+    单遍流式导入上传的CSV文件
+
+    按固定行数分块读取上传流(.gz/.zst会先流式解压，UTF-8/GBK编码自动识别)，在同一遍中完成列校验、
+    book_id冲突解析和重编号，并以gzip压缩后直接写入存储后端，不在本地磁盘落地临时文件。
+    读取的同时计算原始文件的校验和以及解压后内容的SHA-256，后者用于识别重复上传。
+    失败时会删除已写入存储的部分文件。
+
+    Args:
+        stream: 上传文件的二进制流
+        filename: 上传文件名，用于判断压缩格式和生成存储名
+        chunk_size: 每块读取的行数
+
+    Returns:
+        Dict[str, Any]: 包含 stored_filename, book_ids, created_book_ids, total_records, size, stored_size,
+            remapped_book_ids, checksum, content_hash, encoding, stage_timings
+    """
+    start_time = time.time()
+    compression = get_compression(filename)
+    stored_filename = get_stored_filename(filename)
+
+    raw_reader = HashingReader(stream)
+    if compression is None:
+        reader = raw_reader
+    else:
+        reader = HashingReader(open_decompressed(raw_reader, compression))
+
+    resolver = BookIdResolver()
+    total_records = 0
+    size = 0
+
+    text_reader = DecodingReader(reader)
+
+    try:
+        chunks = pd.read_csv(
+            text_reader,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunk_size
+        )
+        with storage.open_write(stored_filename) as writer:
+            counter = CountingWriter(writer)
+            with gzip.GzipFile(fileobj=counter, mode='wb', compresslevel=STORAGE_COMPRESSLEVEL) as compressed:
+                for index, chunk in enumerate(chunks):
+                    if index == 0:
+                        logger.info(f"CSV文件列名: {chunk.columns.tolist()}")
+                        if any(column not in chunk.columns for column in REQUIRED_COLUMNS):
+                            raise ValueError("CSV文件必须包含 book_id 和 book_title 列")
+
+                    id_mapping = resolver.resolve(chunk)
+                    if id_mapping:
+                        # 一次向量化映射替换本块内所有冲突的book_id
+                        chunk['book_id'] = chunk['book_id'].map(id_mapping).fillna(chunk['book_id'])
+
+                    data = chunk.to_csv(index=False, header=(index == 0)).encode('utf-8')
+                    compressed.write(data)
+                    size += len(data)
+                    total_records += len(chunk)
+
+        if size == 0:
+            raise ValueError("CSV文件为空")
+        content_hash = reader.hexdigest()
+        checksum = raw_reader.hexdigest()
+
+    except Exception:
+        try:
+            storage.delete(stored_filename)
+        except Exception as e:
+            logger.warning(f"清理未完成的存储文件失败: {str(e)}")
+        raise
+
+    # 解析与写入在同一遍中交错进行，写入存储的时间单独计为 hdfs_put，其余计为 upload
+    total_seconds = time.time() - start_time
+    stage_timings = [
+        {'stage': 'upload', 'seconds': round(total_seconds - counter.write_seconds, 3), 'records': total_records},
+        {'stage': 'hdfs_put', 'seconds': round(counter.write_seconds, 3), 'records': total_records}
+    ]
+
+    logger.info(
+        f"CSV导入完成，文件: {stored_filename}, 编码: {text_reader.encoding}, 大小: {size}, 压缩后: {counter.size}, "
+        f"总记录数: {total_records}, 唯一book_id数: {len(resolver.book_titles)}, "
+        f"重编号: {len(resolver.id_mapping)}"
+    )
+    return {
+        'stored_filename': stored_filename,
+        'book_ids': resolver.book_ids,
+        'created_book_ids': resolver.created_book_ids,
+        'total_records': total_records,
+        'size': size,
+        'stored_size': counter.size,
+        'remapped_book_ids': len(resolver.id_mapping),
+        'checksum': checksum,
+        'content_hash': content_hash,
+        'encoding': text_reader.encoding,
+        'stage_timings': stage_timings
+    }
@@ -0,0 +1,128 @@
+import os
+import shutil
+import logging
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend(ABC):
+    """存储后端基类，文件名均相对于后端的根目录"""
+
+    @abstractmethod
+    def open_write(self, name: str):
+        """打开一个写入二进制数据的上下文管理器，已存在时覆盖"""
+
+    @abstractmethod
+    def delete(self, name: str, recursive: bool = False) -> bool:
+        """删除文件或目录，返回是否确实删除了内容"""
+
+
+class HDFSStorage(StorageBackend):
+    """
+    基于 WebHDFS 的进程内 HDFS 客户端
+
+    所有请求复用同一个带连接池的 requests.Session，
+    避免每次上传/删除都启动一个 hadoop fs JVM。
+    """
+
+    def __init__(self, url: str, user: str, root: str, pool_size: int = 8, timeout: int = 60):
+        import requests
+        from hdfs import InsecureClient
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        self.root = root
+        self.client = InsecureClient(url, user=user, root=root, session=session, timeout=timeout)
+        logger.info(f"已创建HDFS客户端: {url}, 根目录: {root}, 连接池大小: {pool_size}")
+
+    def open_write(self, name: str):
+        # 不传data时返回流式写入器，数据经由连接池直接写入DataNode
+        return self.client.write(name, overwrite=True)
+
+    def delete(self, name: str, recursive: bool = False) -> bool:
+        deleted = self.client.delete(name, recursive=recursive)
+        if deleted:
+            logger.info(f"已删除HDFS文件: {self.root}/{name}")
+        return deleted
+
+
+class LocalStorage(StorageBackend):
+    """本地文件系统存储，用于测试或单机调试时替代HDFS"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name.lstrip('/'))
+
+    def open_write(self, name: str):
+        target = self._path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return open(target, 'wb')
+
+    def delete(self, name: str, recursive: bool = False) -> bool:
+        target = self._path(name)
+        if os.path.isdir(target):
+            if not recursive:
+                raise IsADirectoryError(target)
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+        else:
+            return False
+        logger.info(f"已删除本地存储文件: {target}")
+        return True
+
+
+def create_backend(config) -> StorageBackend:
+    """
+    根据配置创建存储后端
+
+    Args:
+        config: Flask配置对象
+
+    Returns:
+        StorageBackend: 存储后端实例
+    """
+    backend = config.get('STORAGE_BACKEND', 'hdfs')
+    if backend == 'hdfs':
+        return HDFSStorage(
+            url=f"http://{config['HDFS_HOST']}:{config['HDFS_WEB_PORT']}",
+            user=config['HDFS_USER'],
+            root=config['HDFS_INPUT_DIR'],
+            pool_size=config['HDFS_POOL_SIZE']
+        )
+    if backend == 'local':
+        return LocalStorage(config['LOCAL_STORAGE_FOLDER'])
+    raise ValueError(f"不支持的存储后端: {backend}")
+
+
+class Storage:
+    """
+    存储扩展对象，用法与 PyMongo 相同：先创建实例，再在 create_app 中 init_app
+
+    后端在 init_app 时创建并在进程内共享，后台线程中无需应用上下文即可使用。
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        self.backend = create_backend(app.config)
+
+    def open_write(self, name: str):
+        return self.backend.open_write(name)
+
+    def delete(self, name: str, recursive: bool = False) -> bool:
+        return self.backend.delete(name, recursive=recursive)
+
+
+storage = Storage()
@@ -52,11 +52,17 @@ window.updateUploadTable = function(uploads) {
             switch(upload.status) {
                 case 'queued':
                     statusClass = 'status-badge status-pending';
-                    statusHtml = `排队中 (${upload.queue_position-1})`;
+                    statusHtml = `排队中 (${upload.queue_position})`;
                     break;
                 case 'processing':
                     statusClass = 'status-badge status-processing';
                     statusHtml = '处理中';
+                    if (upload.cancel_requested) {
+                        statusHtml = '取消中';
+                    } else if (upload.analysis_records) {
+                        const percent = Math.floor(upload.processed_records * 100 / upload.analysis_records);
+                        statusHtml += ` ${percent}% (${upload.throughput || 0}条/秒, 剩余${upload.eta})`;
+                    }
                     break;
                 case 'completed':
                     statusClass = 'status-badge status-completed';
@@ -66,6 +72,10 @@ window.updateUploadTable = function(uploads) {
                     statusClass = 'status-badge status-failed';
                     statusHtml = '失败';
                     break;
+                case 'cancelled':
+                    statusClass = 'status-badge status-cancelled';
+                    statusHtml = '已取消';
+                    break;
                 default:
                     statusClass = 'status-badge';
                     statusHtml = upload.status;
@@ -75,7 +85,14 @@ window.updateUploadTable = function(uploads) {
             let operationHtml = `
                 <button class="layui-btn layui-btn-xs" onclick="viewDetails('${upload.file_id}')">
                     <i class="layui-icon layui-icon-search"></i> 查看详情
-                </button>
+                </button>`;
+            if ((upload.status === 'queued' || upload.status === 'processing') && !upload.cancel_requested) {
+                operationHtml += `
+                <button class="layui-btn layui-btn-xs layui-btn-warm" onclick="cancelUpload('${upload.file_id}')">
+                    <i class="layui-icon layui-icon-close"></i> 取消
+                </button>`;
+            }
+            operationHtml += `
                 <button class="layui-btn layui-btn-xs layui-btn-danger" onclick="deleteUpload('${upload.file_id}')">
                     <i class="layui-icon layui-icon-delete"></i> 删除
                 </button>
@@ -105,6 +122,24 @@ window.viewDetails = function(fileId) {
     window.location.href = `/upload/details/${fileId}`;
 };
 
+window.cancelUpload = function(fileId) {
+    layer.confirm('确定要取消这个任务吗？已写入的分析结果将被清理。', {
+        btn: ['确定','取消']
+    }, function(){
+        $.ajax({
+            url: `/api/upload/${fileId}/cancel`,
+            type: 'POST',
+            success: function(res) {
+                layer.msg(res.msg);
+                window.loadSessionUploads();  // 刷新列表
+            },
+            error: function() {
+                layer.msg('取消失败，请重试');
+            }
+        });
+    });
+};
+
 window.deleteUpload = function(fileId) {
     layer.confirm('确定要删除这个文件吗？这将同时删除相关的书籍和评论数据。', {
         btn: ['确定','取消']
@@ -178,6 +213,12 @@ function validateCSVFormat(file) {
             reject('文件名不能包含中文字符');
             return;
         }
+        
+        // 压缩文件无法在浏览器中直接读取表头，由服务端解压后校验
+        if (/\.csv\.(gz|zst)$/i.test(file.name)) {
+            resolve(true);
+            return;
+        }
 
         const reader = new FileReader();
         reader.onload = function(e) {
@@ -199,10 +240,131 @@ function validateCSVFormat(file) {
         reader.onerror = function() {
             reject('读取文件失败');
         };
-        reader.readAsText(file);
+        // 只读取文件开头部分来检查表头，避免大文件整体读入内存
+        reader.readAsText(file.slice(0, 64 * 1024));
+    });
+}
+
+// 超过该大小的文件使用分块上传，分块大小需与服务端 UPLOAD_CHUNK_SIZE 一致
+var CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+var UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+var CHUNK_MAX_RETRIES = 3;
+
+// 计算分块的SHA-256，非安全上下文中不可用时返回null
+function sha256Hex(blob) {
+    if (!window.crypto || !window.crypto.subtle) {
+        return Promise.resolve(null);
+    }
+    return blob.arrayBuffer()
+        .then(buffer => window.crypto.subtle.digest('SHA-256', buffer))
+        .then(hash => Array.from(new Uint8Array(hash))
+            .map(b => b.toString(16).padStart(2, '0'))
+            .join(''));
+}
+
+// 整个文件的校验和需要一次性读入内存计算，超过该大小时只校验各个分块
+var WHOLE_FILE_CHECKSUM_MAX_SIZE = 256 * 1024 * 1024;
+var MERGE_POLL_INTERVAL = 2000;
+
+// 计算整个文件的SHA-256，服务端合并分块时据此校验整个文件；文件过大时返回null
+function fileSha256(file) {
+    if (file.size > WHOLE_FILE_CHECKSUM_MAX_SIZE) {
+        return Promise.resolve(null);
+    }
+    return sha256Hex(file);
+}
+
+function apiRequest(options) {
+    return new Promise((resolve, reject) => {
+        $.ajax(options)
+            .done(res => res.code === 0 ? resolve(res) : reject(res.msg))
+            .fail(() => reject('网络错误，请重试'));
     });
 }
 
+// 分块上传：会话ID保存在localStorage中，断线后重新选择同一文件只补传缺失的分块
+async function chunkedUpload(file, onProgress) {
+    const resumeKey = `chunkedUpload:${file.name}:${file.size}:${file.lastModified}`;
+    let session = null;
+    
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        try {
+            session = (await apiRequest({ url: `/api/upload/chunked/${savedId}`, type: 'GET' })).data;
+            if (session.status !== 'uploading') {
+                session = null;
+            }
+        } catch (error) {
+            session = null;
+        }
+    }
+    
+    if (!session) {
+        session = (await apiRequest({
+            url: '/api/upload/chunked/init',
+            type: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify({
+                filename: file.name,
+                size: file.size,
+                chunk_size: UPLOAD_CHUNK_SIZE,
+                checksum: await fileSha256(file)
+            })
+        })).data;
+        localStorage.setItem(resumeKey, session.upload_id);
+    }
+    
+    const missing = session.missing_chunks;
+    for (let i = 0; i < missing.length; i++) {
+        const index = missing[i];
+        const start = index * session.chunk_size;
+        const blob = file.slice(start, start + session.chunk_size);
+        const checksum = await sha256Hex(blob);
+        
+        for (let attempt = 1; ; attempt++) {
+            try {
+                await apiRequest({
+                    url: `/api/upload/chunked/${session.upload_id}/chunks/${index}`,
+                    type: 'PUT',
+                    data: blob,
+                    processData: false,
+                    contentType: 'application/octet-stream',
+                    headers: checksum ? { 'X-Chunk-Checksum': checksum } : {}
+                });
+                break;
+            } catch (error) {
+                if (attempt >= CHUNK_MAX_RETRIES) {
+                    throw error;
+                }
+            }
+        }
+        
+        if (onProgress) {
+            onProgress(session.total_chunks - missing.length + i + 1, session.total_chunks);
+        }
+    }
+    
+    // 合并和导入在服务端后台进行，轮询会话状态直到得到结果
+    await apiRequest({
+        url: `/api/upload/chunked/${session.upload_id}/complete`,
+        type: 'POST'
+    });
+    for (;;) {
+        await new Promise(resolve => setTimeout(resolve, MERGE_POLL_INTERVAL));
+        const status = (await apiRequest({ url: `/api/upload/chunked/${session.upload_id}`, type: 'GET' })).data;
+        if (status.status === 'completed') {
+            localStorage.removeItem(resumeKey);
+            return status.result;
+        }
+        if (status.status !== 'merging') {
+            if (status.status === 'failed') {
+                localStorage.removeItem(resumeKey);
+            }
+            throw status.error_message || '文件导入失败，请重试';
+        }
+    }
+}
+
 // 主要初始化逻辑
 $(document).ready(function() {
     console.log('页面加载完成，开始初始化');
@@ -223,7 +385,7 @@ $(document).ready(function() {
             elem: '#uploadArea',
             url: '/api/upload',
             accept: 'file',
-            exts: 'csv',
+            exts: 'csv|gz|zst',
             drag: true,         
             multiple: false,    // 不允许多文件
             auto: false,        // 不自动上传
@@ -234,6 +396,21 @@ $(document).ready(function() {
                         // 验证文件格式
                         await validateCSVFormat(file);
                         // 验证通过，开始上传
+                        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+                            var loadingIndex = layer.load();
+                            try {
+                                var res = await chunkedUpload(file, function(done, total) {
+                                    layer.msg(done < total ? `已上传 ${done}/${total} 个分块` : '分块上传完成，正在导入文件');
+                                });
+                                onUploadDone(res);
+                            } catch (error) {
+                                layer.msg(error || '上传失败，请重试');
+                            } finally {
+                                layer.close(loadingIndex);
+                                delete obj.pushFile()[index];
+                            }
+                            return;
+                        }
                         layer.load();
                         obj.upload(index, file);
                     } catch (error) {
@@ -246,12 +423,7 @@ $(document).ready(function() {
             done: function(res){
                 layer.closeAll('loading');
                 if(res.code === 0){
-                    var history = JSON.parse(sessionStorage.getItem('uploadHistory') || '[]');
-                    history.push(res.file_id);
-                    sessionStorage.setItem('uploadHistory', JSON.stringify(history));
-                    layer.msg('文件上传成功，开始处理');
-                    window.loadSessionUploads();  // 立即加载一次
-                    startUploadHistoryCheck();    // 启动轮询
+                    onUploadDone(res);
                 } else {
                     layer.msg(res.msg || '上传失败');
                 }
@@ -322,6 +494,16 @@ $(document).ready(function() {
             }
         });
 
+        // 上传成功后记录到会话历史并开始轮询
+        function onUploadDone(res) {
+            var history = JSON.parse(sessionStorage.getItem('uploadHistory') || '[]');
+            history.push(res.file_id);
+            sessionStorage.setItem('uploadHistory', JSON.stringify(history));
+            layer.msg('文件上传成功，开始处理');
+            window.loadSessionUploads();  // 立即加载一次
+            startUploadHistoryCheck();    // 启动轮询
+        }
+        
         // 上传历史检查函数
         function startUploadHistoryCheck() {
             // 清除之前的定时器
@@ -1,11 +1,15 @@
 import os
+import time
+import socket
+import uuid
 import logging
 from typing import List, Dict, Any, Optional
-from threading import Thread
-import subprocess
+from threading import Thread, Lock, RLock, Event
 from datetime import datetime, timezone
 from flask import current_app
+from pymongo import ReturnDocument
 from app import mongo
+from app.services.storage_service import storage
 from datetime import datetime, timedelta
 from bson import ObjectId
 import re
@@ -32,74 +36,59 @@ def format_file_size(size: int) -> str:
         size /= 1024
     return f"{size:.2f} TB"
 
-def save_file_to_hdfs(local_path: str, filename: str) -> bool:
+def format_duration(seconds: Optional[float]) -> str:
     """
-    使用 HDFS 命令行工具将文件保存到 HDFS
+    格式化剩余时间
+    
+    Args:
+        seconds: 秒数，未知时为None
+    
+    Returns:
+        str: 如 "1小时5分"、"3分20秒"，未知时为 "-"
     """
-    try:
-        hdfs_path = f"/input_data/{filename}"
-        
-        # 使用 hadoop fs 命令上传文件
-        result = subprocess.run(
-            ['hadoop', 'fs', '-put', '-f', local_path, hdfs_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            check=True
-        )
-        
-        if result.returncode == 0:
-            logger.info(f"文件已成功上传到HDFS: {hdfs_path}")
-            return True
-        else:
-            logger.error(f"上传文件到HDFS失败: {result.stderr}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"保存文件到HDFS时发生错误: {str(e)}")
-        return False
-    finally:
-        # 清理临时文件
-        try:
-            os.remove(local_path)
-            logger.info(f"已清理临时文件: {local_path}")
-        except Exception as e:
-            logger.warning(f"清理临时文件失败: {str(e)}")
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}小时{minutes}分"
+    if minutes:
+        return f"{minutes}分{seconds}秒"
+    return f"{seconds}秒"
+
 
+# 算法模块在进程内只加载一次，加载时需要临时替换 sys.modules['config']，用锁串行化这一步
+_algorithm_load_lock = Lock()
+_algorithm_module = None
 
-def run_spark_algorithm(file_id: str, filename: str, batch_size: int = 1000):
+def load_algorithm_module(algorithm_dir: str = '/opt/notebooks'):
     """
-    运行Spark算法处理文件
+    加载算法模块，整个进程只加载一次并复用
+    
+    算法文件依赖同名的 config 模块，这里在锁内临时替换 sys.modules['config']，
+    加载完成后立即恢复。算法以普通模块导入，不再通过 exec 执行，也不修改 sys.argv。
+    
+    Args:
+        algorithm_dir: 算法文件所在目录
+    
+    Returns:
+        module: 算法模块
     """
-    hdfs_path = f"/input_data/{filename}"
-    try:
-        # 首先验证文件格式
-        if not filename.endswith('.csv'):
-            raise Exception("只支持CSV格式文件")
-            
-        # 更新状态为处理中
-        mongo.db.uploads.update_one(
-            {'_id': ObjectId(file_id)},
-            {'$set': {
-                'status': 'processing',
-                'last_updated': get_current_time()
-            }}
-        )
-        
-        logger.info(f"开始处理文件: {filename}, batch_size: {batch_size}")
-        
-        # 直接在当前进程中运行算法
-        import sys
-        import importlib.util
-        
-        # 保存原始参数
-        orig_argv = sys.argv
+    global _algorithm_module
+    import sys
+    import importlib.util
+    
+    with _algorithm_load_lock:
+        if _algorithm_module is not None:
+            return _algorithm_module
         
+        orig_config = sys.modules.get('config')
         try:
             # 直接从算法目录加载配置文件
             spec = importlib.util.spec_from_file_location(
                 "algorithm_config", 
-                "/opt/notebooks/config.py"
+                os.path.join(algorithm_dir, 'config.py')
             )
             algorithm_config = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(algorithm_config)
@@ -107,62 +96,115 @@ def run_spark_algorithm(file_id: str, filename: str, batch_size: int = 1000):
             # 将配置模块添加到sys.modules
             sys.modules['config'] = algorithm_config
             
-            # 设置新参数
-            sys.argv = ['algorithm.py', filename, str(batch_size)]
+            # 算法模块会导入同目录下的 nlp_models 等辅助模块；追加到末尾，不遮蔽Web端的同名模块
+            if algorithm_dir not in sys.path:
+                sys.path.append(algorithm_dir)
             
-            # 执行算法文件
-            with open('/opt/notebooks/algorithm.py', 'r') as f:
-                exec(f.read(), {'__name__': '__main__'})
-            
-            # 如果执行到这里没有抛出异常，说明处理成功
-            # 更新状态为完成
-            mongo.db.uploads.update_one(
-                {'_id': ObjectId(file_id)},
-                {'$set': {
-                    'status': 'completed',
-                    'last_updated': get_current_time()
-                }}
+            # 以非 __main__ 方式导入算法模块，导入时不创建会话也不加载模型
+            spec = importlib.util.spec_from_file_location(
+                "algorithm",
+                os.path.join(algorithm_dir, 'algorithm.py')
             )
-
-            # 处理完成后调用process_upload_complete 
-            process_upload_complete(file_id)
-            logger.info(f"文件 {filename} 处理完成")
-            
-            # 处理完成后删除HDFS文件
-            try:
-                delete_hdfs_file(hdfs_path)
-                logger.info(f"已清理HDFS临时文件: {hdfs_path}")
-            except Exception as e:
-                logger.warning(f"清理HDFS文件失败: {str(e)}")
-            
-            return True
+            algorithm = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(algorithm)
+            _algorithm_module = algorithm
+            logger.info(f"算法模块已加载: {spec.origin}")
+            return _algorithm_module
             
         finally:
-            # 恢复原始参数
-            sys.argv = orig_argv
-            
-            # 清理sys.modules
-            if 'config' in sys.modules:
-                del sys.modules['config']
+            # 恢复原始的config模块
+            if orig_config is not None:
+                sys.modules['config'] = orig_config
+            else:
+                sys.modules.pop('config', None)
+
+def run_spark_algorithm(file_id: str, filename: str, batch_size: int = 1000,
+                        lease_owner: Optional[str] = None):
+    """
+    运行Spark算法处理文件
+    
+    任务在调度时已通过租约认领，处理期间由心跳线程续约并检查取消请求；
+    结束时只有仍持有租约的进程才会写入最终状态和清理HDFS文件。
+    """
+    heartbeat = None
+    try:
+        # 首先验证文件格式
+        if not filename.endswith(('.csv', '.csv.gz')):
+            raise Exception("只支持CSV格式文件")
+        
+        # 复用进程内常驻的分析引擎，SparkSession和模型不随任务重建
+        algorithm = load_algorithm_module(current_app.config['ALGORITHM_DIR'])
+        engine = algorithm.get_engine()
+        # 以本次认领的租约令牌作为Spark作业组，取消时只停止本次尝试的作业，不影响同一任务的重试
+        job_group = lease_owner or file_id
+        
+        if lease_owner:
+            heartbeat = LeaseHeartbeat(
+                file_id,
+                lease_owner,
+                current_app.config['UPLOAD_LEASE_SECONDS'],
+                current_app.config['UPLOAD_HEARTBEAT_SECONDS'],
+                on_cancel=lambda: engine.cancel(job_group)
+            )
+            heartbeat.start()
+        
+        logger.info(f"开始处理文件: {filename}, batch_size: {batch_size}")
+        
+        # 重试时先删除中断的那次尝试已写入的评论，书籍信息按book_id覆盖写入，不会重复
+        deleted = mongo.db.comments_tags.delete_many({'upload_id': file_id}).deleted_count
+        if deleted:
+            logger.info(f"已删除任务 {file_id} 上一次尝试写入的 {deleted} 条评论")
+        
+        engine.process(
+            filename,
+            batch_size,
+            UploadProgress(file_id, lease_owner),
+            job_group=job_group,
+            stage_callback=lambda stages: record_stage_timings(file_id, stages),
+            upload_id=file_id,
+            stats_callback=lambda stats: record_analysis_stats(file_id, stats)
+        )
+        
+        # 处理完成前收到的取消请求同样生效
+        if is_cancel_requested(file_id):
+            return finish_cancelled_upload(file_id, filename, lease_owner)
+        
+        # 如果执行到这里没有抛出异常，说明处理成功
+        # 更新状态为完成
+        if not release_upload(file_id, lease_owner, {'status': 'completed', 'error_message': None}):
+            logger.warning(f"文件 {filename} 的租约已失效，不再更新其状态")
+            return False
+        logger.info(f"文件 {filename} 处理完成")
+        
+        # 处理完成后删除HDFS文件
+        try:
+            stage_start = time.time()
+            delete_hdfs_file(filename)
+            record_stage_timings(file_id, [{'stage': 'cleanup', 'seconds': round(time.time() - stage_start, 3), 'records': None}])
+            logger.info(f"已清理HDFS临时文件: {filename}")
+        except Exception as e:
+            logger.warning(f"清理HDFS文件失败: {str(e)}")
+        
+        # 释放工作槽位并启动下一个任务
+        process_upload_complete(file_id)
+        return True
                 
     except Exception as e:
+        if is_cancel_requested(file_id):
+            return finish_cancelled_upload(file_id, filename, lease_owner)
+        
         error_msg = str(e)
         logger.error(f"处理文件 {filename} 时发生错误: {error_msg}")
         
         # 更新上传记录状态
-        mongo.db.uploads.update_one(
-            {'_id': ObjectId(file_id)},
-            {'$set': {
-                'status': 'failed',
-                'error_message': error_msg,
-                'last_updated': get_current_time()
-            }}
-        )
+        if not release_upload(file_id, lease_owner, {'status': 'failed', 'error_message': error_msg}):
+            logger.warning(f"文件 {filename} 的租约已失效，不再更新其状态")
+            return False
         
         # 即使处理失败也尝试删除HDFS文件
         try:
-            delete_hdfs_file(hdfs_path)
-            logger.info(f"已清理HDFS临时文件: {hdfs_path}")
+            delete_hdfs_file(filename)
+            logger.info(f"已清理HDFS临时文件: {filename}")
         except Exception as e:
             logger.warning(f"清理HDFS文件失败: {str(e)}")
             
@@ -170,26 +212,205 @@ def run_spark_algorithm(file_id: str, filename: str, batch_size: int = 1000):
         process_upload_complete(file_id)
             
         return False
+    
+    finally:
+        if heartbeat:
+            heartbeat.stop()
 
-def delete_hdfs_file(hdfs_path: str) -> bool:
+# 重新处理任务时保留的阶段(导入阶段只在上传时执行一次)
+INGEST_STAGES = ['upload', 'hdfs_put']
+
+def record_stage_timings(file_id: str, stages: List[Dict[str, Any]]):
     """
-    使用 hadoop fs 命令删除 HDFS 文件
+    将任务各阶段的耗时追加到上传记录的 stage_timings
+    
+    Args:
+        file_id: 上传记录ID
+        stages: [{'stage', 'seconds', 'records'}]
     """
     try:
-        result = subprocess.run(
-            ['hadoop', 'fs', '-rm', hdfs_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            check=True
+        mongo.db.uploads.update_one(
+            {'_id': ObjectId(file_id)},
+            {'$push': {'stage_timings': {'$each': stages}}}
         )
-        
-        if result.returncode == 0:
-            logger.info(f"已删除HDFS文件: {hdfs_path}")
+    except Exception as e:
+        logger.warning(f"记录任务 {file_id} 的阶段耗时失败: {str(e)}")
+
+def record_analysis_stats(file_id: str, stats: Dict[str, int]):
+    """
+    将分析阶段的去重和缓存统计写入上传记录的 analysis_stats
+    
+    Args:
+        file_id: 上传记录ID
+        stats: {input_rows, duplicate_comment_ids, cache_hits, analyzed_contents}
+    """
+    try:
+        mongo.db.uploads.update_one(
+            {'_id': ObjectId(file_id)},
+            {'$set': {'analysis_stats': stats}}
+        )
+    except Exception as e:
+        logger.warning(f"记录任务 {file_id} 的分析统计失败: {str(e)}")
+
+def summarize_stage_timings(stage_timings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    按阶段汇总耗时(同一阶段可能记录多次，如分析引擎和Web进程各自的清理)，并计算占比和速度
+    
+    Returns:
+        List[Dict[str, Any]]: 按阶段首次出现顺序排列，包含 stage, seconds, records, percent, throughput
+    """
+    summary = {}
+    for entry in stage_timings or []:
+        stage = summary.setdefault(entry['stage'], {'stage': entry['stage'], 'seconds': 0.0, 'records': None})
+        stage['seconds'] += entry.get('seconds') or 0
+        if entry.get('records') is not None:
+            stage['records'] = (stage['records'] or 0) + entry['records']
+    
+    total_seconds = sum(stage['seconds'] for stage in summary.values())
+    for stage in summary.values():
+        stage['seconds'] = round(stage['seconds'], 2)
+        stage['percent'] = round(stage['seconds'] * 100 / total_seconds, 1) if total_seconds else 0
+        stage['throughput'] = round(stage['records'] / stage['seconds'], 1) if stage['records'] and stage['seconds'] else None
+    return list(summary.values())
+
+def is_cancel_requested(file_id: str) -> bool:
+    """检查上传任务是否已被请求取消"""
+    upload = mongo.db.uploads.find_one({'_id': ObjectId(file_id)}, {'cancel_requested': 1})
+    return bool(upload and upload.get('cancel_requested'))
+
+def is_results_shared(upload: Dict[str, Any]) -> bool:
+    """
+    检查这次上传的结果是否仍被其他上传记录引用
+    
+    结果归属于实际处理的上传(重复上传记录的 duplicate_of，否则为它自己)。只有引用同一结果的
+    其他记录(原上传本身或其他复用它的重复上传)仍存在时才保留；内容相同但各自独立处理的上传
+    写入的是各自的评论，互不影响。
+    """
+    owner_id = upload.get('duplicate_of') or upload['_id']
+    if mongo.db.uploads.count_documents({
+        '_id': {'$ne': upload['_id']},
+        '$or': [{'_id': owner_id}, {'duplicate_of': owner_id}]
+    }) > 0:
+        logger.info(f"上传 {upload['_id']} 的结果仍被其他上传记录引用，保留书籍和评论数据")
+        return True
+    return False
+
+def purge_upload_results(upload: Dict[str, Any]) -> int:
+    """
+    清理上传任务自己写入的评论，以及由它新建的书籍
+    
+    评论按写入时记录的 upload_id 删除；书籍只删除导入时尚不存在(created_book_ids)
+    且已没有任何评论引用的book_id。导入时复用的同名已有书籍及其他上传的评论不受影响。
+    复用结果的重复上传记录清理的是原上传写入的数据。
+    
+    Returns:
+        int: 清理的书籍数
+    """
+    if is_results_shared(upload):
+        return 0
+    
+    if 'created_book_ids' not in upload:
+        # 旧的上传记录写入评论时没有 upload_id，也没有记录新建的书籍，只能按book_id清理
+        book_ids = upload.get('book_ids', [])
+        if book_ids:
+            mongo.db.books_info.delete_many({'book_id': {'$in': book_ids}})
+            mongo.db.comments_tags.delete_many({'book_id': {'$in': book_ids}})
+            logger.info(f"已按book_id清理旧上传记录 {upload['_id']} 的 {len(book_ids)} 本书的数据")
+        return len(book_ids)
+    
+    results_upload_id = str(upload.get('duplicate_of') or upload['_id'])
+    deleted_comments = mongo.db.comments_tags.delete_many({'upload_id': results_upload_id}).deleted_count
+    
+    orphaned_book_ids = []
+    created_book_ids = upload['created_book_ids']
+    if created_book_ids:
+        # 其他上传可能也写入了这些书的评论(例如两次上传在对方处理完成前导入)，仍被引用的书保留
+        referenced = set(mongo.db.comments_tags.distinct('book_id', {'book_id': {'$in': created_book_ids}}))
+        orphaned_book_ids = [book_id for book_id in created_book_ids if book_id not in referenced]
+        if orphaned_book_ids:
+            mongo.db.books_info.delete_many({'book_id': {'$in': orphaned_book_ids}})
+    
+    logger.info(
+        f"已清理上传 {upload['_id']} 写入的 {deleted_comments} 条评论和 {len(orphaned_book_ids)} 本新建的书籍"
+    )
+    return len(orphaned_book_ids)
+
+def finish_cancelled_upload(file_id: str, filename: str, lease_owner: Optional[str]) -> bool:
+    """
+    结束已取消的任务：清理已写入的结果，标记为已取消(删除时直接删除记录)，并释放工作槽位
+    
+    Returns:
+        bool: 始终返回False，表示任务没有处理完成
+    """
+    query = {'_id': ObjectId(file_id)}
+    if lease_owner:
+        query['lease_owner'] = lease_owner
+    upload = mongo.db.uploads.find_one(query)
+    if not upload:
+        logger.warning(f"文件 {filename} 的租约已失效，不再更新其状态")
+        return False
+    
+    purge_upload_results(upload)
+    if upload.get('delete_on_cancel'):
+        mongo.db.uploads.delete_one(query)
+        logger.info(f"文件 {filename} 已取消并删除上传记录")
+    else:
+        release_upload(file_id, lease_owner, {'status': 'cancelled', 'error_message': None})
+        logger.info(f"文件 {filename} 已取消")
+    
+    try:
+        delete_hdfs_file(filename)
+    except Exception as e:
+        logger.warning(f"清理HDFS文件失败: {str(e)}")
+    
+    process_upload_complete(file_id)
+    return False
+
+def request_cancel(file_id: str, delete: bool = False) -> Optional[str]:
+    """
+    请求取消上传任务
+    
+    排队中的任务直接取消；处理中的任务只标记 cancel_requested，由持有租约的进程在下一次心跳时
+    取消其Spark作业组，清理已写入的结果后标记为已取消。
+    
+    Args:
+        file_id: 上传记录ID
+        delete: 取消完成后是否直接删除上传记录
+    
+    Returns:
+        Optional[str]: 'cancelled' 已取消，'cancelling' 正在取消，None 任务已结束无法取消
+    """
+    now = get_current_time()
+    upload = mongo.db.uploads.find_one_and_update(
+        {'_id': ObjectId(file_id), 'status': 'queued'},
+        {'$set': {'status': 'cancelled', 'last_updated': now}}
+    )
+    if upload:
+        delete_hdfs_file(get_stored_filename(upload))
+        logger.info(f"已取消排队中的任务: {file_id}")
+        return 'cancelled'
+    
+    fields = {'cancel_requested': True, 'last_updated': now}
+    if delete:
+        fields['delete_on_cancel'] = True
+    result = mongo.db.uploads.update_one(
+        {'_id': ObjectId(file_id), 'status': 'processing'},
+        {'$set': fields}
+    )
+    if result.matched_count:
+        logger.info(f"已请求取消处理中的任务: {file_id}")
+        return 'cancelling'
+    return None
+
+def delete_hdfs_file(filename: str) -> bool:
+    """
+    通过存储后端删除 HDFS 输入目录中的文件
+    """
+    try:
+        if storage.delete(filename):
             return True
-        else:
-            logger.error(f"删除HDFS文件失败: {result.stderr}")
-            return False
+        logger.warning(f"HDFS文件不存在: {filename}")
+        return False
             
     except Exception as e:
         logger.error(f"删除HDFS文件时发生错误: {str(e)}")
@@ -339,169 +560,538 @@ def get_sentiment_stats(book_id: str) -> Dict[str, int]:
         logger.error(f"获取情感统计时发生错误: {str(e)}")
         return {'total': 0, 'positive': 0, 'negative': 0}
 
-def count_csv_lines_efficient(file_path, sample_size=65536):
+def get_worker_id() -> str:
+    """当前进程的标识(主机名:进程号)，gunicorn fork 出的每个进程各不相同"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# SJF策略每次认领时按得分取前几个候选，依次尝试原子认领
+SJF_CLAIM_CANDIDATES = 5
+
+def queue_order_stages(now: datetime) -> List[Dict[str, Any]]:
     """
-    高效计算大文件的行数，支持多种编码格式
+    按配置的调度策略生成排队任务排序的聚合阶段
+    
+    fifo: 按入队序号先进先出。
+    sjf: 短作业优先并随等待时间老化，得分 = total_records - 老化速率 × 等待分钟数，
+    得分越小越先处理。大文件的得分随等待不断降低，最终一定会被调度，不会饿死。
     
     Args:
-        file_path: 文件路径
-        sample_size: 采样大小，用于估算大文件的行数
+        now: 计算等待时间的当前时间
+    
+    Returns:
+        List[Dict[str, Any]]: 聚合管道阶段
+    """
+    policy = current_app.config['UPLOAD_SCHEDULER_POLICY']
+    if policy == 'fifo':
+        return [{'$sort': {'enqueue_seq': 1, 'upload_time': 1}}]
+    if policy == 'sjf':
+        aging_rate = current_app.config['UPLOAD_SJF_AGING_RECORDS_PER_MINUTE']
+        return [
+            {'$addFields': {'queue_score': {'$subtract': [
+                {'$ifNull': ['$total_records', 0]},
+                {'$multiply': [
+                    aging_rate,
+                    {'$divide': [{'$subtract': [now, '$upload_time']}, 60 * 1000]}
+                ]}
+            ]}}},
+            {'$sort': {'queue_score': 1, 'enqueue_seq': 1}}
+        ]
+    raise ValueError(f"不支持的调度策略: {policy}")
+
+def claim_next_upload(worker_id: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+    """
+    按调度策略原子地认领下一个上传任务
+    
+    fifo 策略下查找与状态切换在一次 find_one_and_update 中完成；sjf 策略先按得分选出候选，
+    再按 _id 和排队状态原子认领。两种方式下多个Web/Worker进程同时调度时
+    同一任务都只会被一个进程认领。
+    
+    每次认领生成新的租约令牌(进程标识:随机串)写入 lease_owner，续约、进度更新和释放都按令牌校验。
+    同一进程对同一任务的前后两次尝试令牌不同，被回收的旧尝试不会误写新尝试的状态。
+    
+    Args:
+        worker_id: 认领任务的进程标识
+        lease_seconds: 租约时长(秒)
+    
+    Returns:
+        Optional[Dict[str, Any]]: 认领到的上传记录(lease_owner 为本次认领的租约令牌)，没有排队任务时返回None
+    """
+    now = get_current_time()
+    lease_owner = f"{worker_id}:{uuid.uuid4().hex}"
+    claimable = {
+        'status': 'queued',
+        # 重试的任务在退避时间结束前不会被认领
+        '$or': [{'not_before': None}, {'not_before': {'$lte': now}}]
+    }
+    update = {
+        '$inc': {'attempts': 1},
+        '$set': {
+            'status': 'processing',
+            'lease_owner': lease_owner,
+            'lease_expires_at': now + timedelta(seconds=lease_seconds),
+            'heartbeat_at': now,
+            'last_updated': now
+        },
+        # 重试时清除上一次尝试记录的分析统计和分析阶段耗时
+        '$unset': {'not_before': '', 'analysis_stats': ''},
+        '$pull': {'stage_timings': {'stage': {'$nin': INGEST_STAGES}}}
+    }
+    
+    if current_app.config['UPLOAD_SCHEDULER_POLICY'] == 'fifo':
+        return mongo.db.uploads.find_one_and_update(
+            claimable,
+            update,
+            sort=[('enqueue_seq', 1), ('upload_time', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    candidates = mongo.db.uploads.aggregate(
+        [{'$match': claimable}]
+        + queue_order_stages(now)
+        + [{'$limit': SJF_CLAIM_CANDIDATES}, {'$project': {'_id': 1}}]
+    )
+    for candidate in candidates:
+        # 候选可能已被其他进程认领，认领时重新校验排队状态
+        task = mongo.db.uploads.find_one_and_update(
+            dict(claimable, _id=candidate['_id']),
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if task:
+            return task
+    return None
+
+def renew_lease(file_id: str, lease_owner: str, lease_seconds: int) -> Optional[Dict[str, Any]]:
+    """
+    续约处理中的任务
+    
+    Returns:
+        Optional[Dict[str, Any]]: 仍持有租约时返回包含 cancel_requested 的上传记录，否则返回None
+    """
+    now = get_current_time()
+    return mongo.db.uploads.find_one_and_update(
+        {'_id': ObjectId(file_id), 'status': 'processing', 'lease_owner': lease_owner},
+        {'$set': {
+            'lease_expires_at': now + timedelta(seconds=lease_seconds),
+            'heartbeat_at': now
+        }},
+        projection={'cancel_requested': 1}
+    )
+
+def release_upload(file_id: str, lease_owner: Optional[str], fields: Dict[str, Any]) -> bool:
+    """
+    写入任务的最终状态并释放租约
+    
+    Args:
+        file_id: 上传记录ID
+        lease_owner: 租约持有者标识，为None时不校验租约
+        fields: 需要写入的字段，如 status, error_message
+    
+    Returns:
+        bool: 租约仍由当前进程持有并已更新时返回True
+    """
+    query = {'_id': ObjectId(file_id)}
+    if lease_owner:
+        query['lease_owner'] = lease_owner
+    result = mongo.db.uploads.update_one(
+        query,
+        {
+            '$set': dict(fields, last_updated=get_current_time()),
+            '$unset': {'lease_owner': '', 'lease_expires_at': ''}
+        }
+    )
+    return result.matched_count > 0
+
+class UploadProgress:
+    """
+    分析进度回调，把已处理记录数、吞吐量和预计剩余时间写回上传记录
+    
+    吞吐量从第一次回报(分析阶段开始)起计算。
+    """
+    
+    def __init__(self, file_id: str, lease_owner: Optional[str] = None):
+        self.file_id = file_id
+        self.lease_owner = lease_owner
+        self._started_at = None
+    
+    def __call__(self, processed_records: int, total_records: int):
+        now = time.time()
+        if self._started_at is None:
+            self._started_at = now
+        elapsed = now - self._started_at
         
+        throughput = processed_records / elapsed if elapsed > 0 else 0
+        remaining = max(0, total_records - processed_records)
+        if remaining == 0:
+            eta_seconds = 0
+        elif throughput > 0:
+            eta_seconds = int(remaining / throughput)
+        else:
+            eta_seconds = None
+        
+        query = {'_id': ObjectId(self.file_id)}
+        if self.lease_owner:
+            query['lease_owner'] = self.lease_owner
+        mongo.db.uploads.update_one(query, {'$set': {
+            'processed_records': processed_records,
+            'analysis_records': total_records,
+            'throughput': round(throughput, 2),
+            'eta_seconds': eta_seconds,
+            'last_updated': get_current_time()
+        }})
+
+class LeaseHeartbeat:
+    """
+    后台定期续约的心跳线程，任务结束时调用 stop()
+    
+    发现取消请求或租约已被回收时调用 on_cancel：租约丢失说明任务已被重新排队，
+    需要停止本进程中的这次尝试，避免与接手的进程同时写入结果。
+    on_cancel 返回False表示处理尚未开始、取消没有生效，下一次心跳时重试。
+    """
+    
+    def __init__(self, file_id: str, lease_owner: str, lease_seconds: int, interval: int, on_cancel=None):
+        self.file_id = file_id
+        self.lease_owner = lease_owner
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.on_cancel = on_cancel
+        self._cancel_sent = False
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stopped.set()
+    
+    def _run(self):
+        lease_lost = False
+        while not self._stopped.wait(self.interval):
+            try:
+                if not lease_lost:
+                    upload = renew_lease(self.file_id, self.lease_owner, self.lease_seconds)
+                    if not upload:
+                        logger.warning(f"任务 {self.file_id} 的租约已被其他进程接管，停止本次处理")
+                        lease_lost = True
+                    elif not upload.get('cancel_requested'):
+                        continue
+                self._cancel()
+            except Exception as e:
+                logger.error(f"任务 {self.file_id} 续约失败: {str(e)}")
+    
+    def _cancel(self):
+        if self.on_cancel and not self._cancel_sent:
+            self._cancel_sent = self.on_cancel() is not False
+
+
+def reap_expired_uploads(max_attempts: int, backoff_seconds: int) -> int:
+    """
+    回收租约已过期的处理中任务
+    
+    持有租约的进程崩溃或重启后心跳停止，租约到期的任务会按退避时间重新排队
+    (保留原入队序号)，达到最大尝试次数后标记为失败。没有租约字段的旧记录同样视为过期。
+    更新时校验租约未被续约，多个进程同时回收也不会互相覆盖。
+    
+    Args:
+        max_attempts: 最大尝试次数
+        backoff_seconds: 退避基准秒数，第n次重试前等待 backoff_seconds * 2^(n-1) 秒
+    
     Returns:
-        int: 估算的总行数
+        int: 回收的任务数
+    """
+    now = get_current_time()
+    expired_tasks = list(mongo.db.uploads.find(
+        {
+            'status': 'processing',
+            '$or': [{'lease_expires_at': None}, {'lease_expires_at': {'$lt': now}}]
+        },
+        {
+            'filename': 1, 'stored_filename': 1, 'attempts': 1, 'lease_owner': 1, 'lease_expires_at': 1,
+            'cancel_requested': 1, 'delete_on_cancel': 1, 'book_ids': 1, 'created_book_ids': 1,
+            'duplicate_of': 1, 'content_hash': 1
+        }
+    ))
+    
+    reaped = 0
+    for task in expired_tasks:
+        attempts = task.get('attempts', 1)
+        query = {
+            '_id': task['_id'],
+            'status': 'processing',
+            'lease_owner': task.get('lease_owner'),
+            'lease_expires_at': task.get('lease_expires_at')
+        }
+        if task.get('cancel_requested'):
+            # 已请求取消的任务不再重试，清理已写入的结果
+            if task.get('delete_on_cancel'):
+                if mongo.db.uploads.delete_one(query).deleted_count:
+                    reaped += 1
+                    purge_upload_results(task)
+                    delete_hdfs_file(get_stored_filename(task))
+                continue
+            update = {
+                '$set': {'status': 'cancelled', 'last_updated': now},
+                '$unset': {'lease_owner': '', 'lease_expires_at': ''}
+            }
+        elif attempts >= max_attempts:
+            update = {
+                '$set': {
+                    'status': 'failed',
+                    'error_message': f"任务处理中断且已重试 {attempts} 次",
+                    'last_updated': now
+                },
+                '$unset': {'lease_owner': '', 'lease_expires_at': ''}
+            }
+        else:
+            delay = backoff_seconds * (2 ** (attempts - 1))
+            update = {
+                '$set': {
+                    'status': 'queued',
+                    'not_before': now + timedelta(seconds=delay),
+                    'error_message': f"任务处理中断(持有者: {task.get('lease_owner')})，{delay} 秒后重试",
+                    'last_updated': now
+                },
+                '$unset': {'lease_owner': '', 'lease_expires_at': ''}
+            }
+        
+        if mongo.db.uploads.update_one(query, update).modified_count:
+            reaped += 1
+            if update['$set']['status'] == 'cancelled':
+                purge_upload_results(task)
+                delete_hdfs_file(get_stored_filename(task))
+            logger.warning(
+                f"回收租约过期的任务 {task['_id']}({task.get('filename')})，"
+                f"已尝试 {attempts}/{max_attempts} 次，新状态: {update['$set']['status']}"
+            )
+    return reaped
+
+def run_queue_maintenance(app):
     """
-    encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030']  # 常见中文编码
+    定时任务：回收租约过期的任务，并用空闲槽位启动排队任务(包括退避结束的重试任务)
     
-    def try_read_file(encoding):
+    Args:
+        app: Flask应用，定时任务线程中需要手动进入应用上下文
+    """
+    with app.app_context():
         try:
-            file_size = os.path.getsize(file_path)
-            
-            if file_size <= sample_size * 2:
-                # 小文件直接计算
-                with open(file_path, 'r', encoding=encoding) as f:
-                    return sum(1 for _ in f) - 1  # 减去标题行
-            
-            # 大文件采样估算
-            with open(file_path, 'r', encoding=encoding) as f:
-                # 读取开头部分
-                start = f.read(sample_size)
-                f.seek(max(file_size - sample_size, 0))  # 跳到接近文件末尾
-                end = f.read(sample_size)
-                
-                # 计算平均行长度
-                total_lines = start.count('\n') + end.count('\n')
-                total_size = len(start) + len(end)
-                avg_line_length = total_size / total_lines if total_lines > 0 else 100
-                
-                # 估算总行数
-                estimated_lines = int(file_size / avg_line_length)
-                
-                logger.info(f"文件 {os.path.basename(file_path)} 行数估算: 平均行长度={avg_line_length:.2f}, 估算总行数={estimated_lines}, 编码={encoding}")
-                
-                return max(0, estimated_lines - 1)  # 减去标题行
-                
-        except UnicodeDecodeError:
-            return None
+            reap_expired_uploads(
+                app.config['UPLOAD_MAX_ATTEMPTS'],
+                app.config['UPLOAD_RETRY_BACKOFF_SECONDS']
+            )
         except Exception as e:
-            logger.error(f"使用编码 {encoding} 读取文件时发生错误: {str(e)}")
-            return None
-    
-    # 尝试不同的编码
-    for encoding in encodings:
-        result = try_read_file(encoding)
-        if result is not None:
-            return result
-    
-    # 如果所有编码都失败，记录错误并返回0
-    logger.error(f"无法使用任何支持的编码读取文件: {file_path}")
-    return 0
+            logger.error(f"回收过期任务时发生错误: {str(e)}")
+        manage_upload_queue()
+
 
+# 同一进程内多个请求线程同时调度队列时，避免重复统计空闲槽位
+# 启动失败时会在持有锁的情况下重新调度，因此使用可重入锁
+_queue_lock = RLock()
 
 def manage_upload_queue():
-    """更新队列中任务的位置"""
+    """
+    按并发上限认领并启动排队任务
+    
+    任务通过租约原子认领，多个进程共享同一个队列时不会重复处理同一文件。
+    并发上限按处理中任务数估算，多个进程同时调度时可能短暂超出。
+    排队位置在读取时由入队序号计算，调度时不再逐条改写排队中的记录。
+    
+    只在 inline 模式下由Web进程调度；worker 模式下任务由独立的 worker.py 进程认领。
+    """
+    if current_app.config['UPLOAD_EXECUTION_MODE'] != 'inline':
+        return
     try:
-        # 首先检查是否有正在处理的任务
-        processing_task = mongo.db.uploads.find_one({'status': 'processing'})
-        
-        if not processing_task:
-            # 如果没有正在处理的任务，查找第一个排队的任务
-            next_task = mongo.db.uploads.find_one(
-                {'status': 'queued'},
-                sort=[('upload_time', 1)]
-            )
+        with _queue_lock:
+            concurrency = current_app.config['UPLOAD_WORKER_CONCURRENCY']
+            lease_seconds = current_app.config['UPLOAD_LEASE_SECONDS']
+            worker_id = get_worker_id()
+            processing_count = mongo.db.uploads.count_documents({'status': 'processing'})
+            free_slots = max(0, concurrency - processing_count)
             
-            if next_task:
-                # 更新任务状态为处理中
-                mongo.db.uploads.update_one(
-                    {'_id': next_task['_id']},
-                    {
-                        '$set': {
-                            'status': 'processing',
-                            'queue_position': 1,
-                            'last_updated': get_current_time()
-                        }
-                    }
-                )
+            # 按入队顺序依次认领排队任务，直到占满空闲槽位
+            started = 0
+            while started < free_slots:
+                next_task = claim_next_upload(worker_id, lease_seconds)
+                if not next_task:
+                    break
+                
                 # 启动处理
-                process_file_async(str(next_task['_id']), next_task['filename'])
-        
-        # 获取所有排队的任务并更新位置
-        queued_tasks = list(mongo.db.uploads.find({
-            'status': 'queued'
-        }).sort('upload_time', 1))
-        
-        # 更新排队任务的位置
-        for position, task in enumerate(queued_tasks, 2):  # 从2开始，因为1是处理中的任务
-            mongo.db.uploads.update_one(
-                {'_id': task['_id']},
-                {
-                    '$set': {
-                        'queue_position': position,
-                        'last_updated': get_current_time()
-                    }
-                }
-            )
+                process_file_async(str(next_task['_id']), get_stored_filename(next_task), next_task['lease_owner'])
+                started += 1
         
         # 记录队列状态
-        logger.info(f"当前队列状态: 处理中任务: {'有' if processing_task else '无'}, 排队任务数: {len(queued_tasks)}")
+        queued_count = mongo.db.uploads.count_documents({'status': 'queued'})
+        logger.info(f"当前队列状态: 处理中任务: {processing_count + started}/{concurrency}, 排队任务数: {queued_count}")
                 
     except Exception as e:
-        logger.error(f"更新队列位置时发生错误: {str(e)}")
+        logger.error(f"调度上传队列时发生错误: {str(e)}")
+
+def next_enqueue_seq() -> int:
+    """通过计数器原子地生成单调递增的入队序号"""
+    counter = mongo.db.counters.find_one_and_update(
+        {'_id': 'upload_enqueue_seq'},
+        {'$inc': {'value': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['value']
+
+def get_queue_position(upload: Dict[str, Any]) -> Optional[int]:
+    """
+    计算单个上传记录的排队位置
+    
+    fifo 策略下排在它前面的排队任务数通过 (status, enqueue_seq) 索引统计，不需要在记录中保存位置；
+    其他策略的名次随时间变化，按策略排序后计算。
+    
+    Args:
+        upload: 上传记录
+    
+    Returns:
+        Optional[int]: 从1开始的排队位置，不在排队中时返回None
+    """
+    if upload.get('status') != 'queued':
+        return None
+    if current_app.config['UPLOAD_SCHEDULER_POLICY'] != 'fifo':
+        return get_queue_positions([upload]).get(upload['_id'])
+    return mongo.db.uploads.count_documents({
+        'status': 'queued',
+        'enqueue_seq': {'$lt': upload.get('enqueue_seq', 0)}
+    }) + 1
+
+def get_queue_positions(uploads: List[Dict[str, Any]]) -> Dict[ObjectId, int]:
+    """
+    批量计算多个上传记录的排队位置，用于列表页面
+    
+    只查询一次排队任务并按调度策略排序，在内存中得到每条记录的名次。
+    
+    Args:
+        uploads: 上传记录列表
+    
+    Returns:
+        Dict[ObjectId, int]: 排队中的记录ID到排队位置的映射
+    """
+    if not any(upload.get('status') == 'queued' for upload in uploads):
+        return {}
+    queued = mongo.db.uploads.aggregate(
+        [{'$match': {'status': 'queued'}}]
+        + queue_order_stages(get_current_time())
+        + [{'$project': {'_id': 1}}]
+    )
+    return {task['_id']: position for position, task in enumerate(queued, 1)}
+
+def get_stored_filename(upload: Dict[str, Any]) -> str:
+    """获取上传记录对应的HDFS文件名，兼容没有 stored_filename 的旧记录"""
+    return upload.get('stored_filename') or upload['filename']
+
+def find_completed_duplicate(content_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    查找内容哈希相同且已处理完成的上传记录
+    
+    Args:
+        content_hash: 上传内容的SHA-256
+    
+    Returns:
+        Optional[Dict[str, Any]]: 最近一次完成的相同文件记录，不存在时返回None
+    """
+    if not content_hash:
+        return None
+    return mongo.db.uploads.find_one(
+        {'content_hash': content_hash, 'status': 'completed'},
+        sort=[('upload_time', -1)]
+    )
+
+def enqueue_upload(filename: str, ingest_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    为已导入存储的文件创建上传记录并加入处理队列
+    
+    如果相同内容的文件已经处理完成，则直接复用其结果，不再重复运行分析任务。
+    
+    Args:
+        filename: 上传的原始文件名
+        ingest_result: 导入结果，包含 stored_filename, size, stored_size, total_records,
+            book_ids, created_book_ids, remapped_book_ids, content_hash
+    
+    Returns:
+        Dict[str, Any]: 包含 file_id, queue_position 和 duplicate_of
+    """
+    file_id = ObjectId()
+    upload_record = {
+        '_id': file_id,
+        'filename': filename,
+        'stored_filename': ingest_result['stored_filename'],
+        'size': ingest_result['size'],
+        'stored_size': ingest_result['stored_size'],
+        'upload_time': get_current_time(),
+        'status': 'queued',
+        'processed_records': 0,
+        'total_records': ingest_result['total_records'],
+        'book_ids': ingest_result['book_ids'],
+        'created_book_ids': ingest_result['created_book_ids'],
+        'remapped_book_ids': ingest_result['remapped_book_ids'],
+        'content_hash': ingest_result['content_hash'],
+        'stage_timings': ingest_result.get('stage_timings', []),
+        'last_updated': get_current_time()
+    }
+    
+    duplicate = find_completed_duplicate(ingest_result['content_hash'])
+    if duplicate:
+        # 相同内容已处理完成，删除刚写入的文件并直接指向已有结果
+        delete_hdfs_file(ingest_result['stored_filename'])
+        upload_record.update({
+            'status': 'completed',
+            'processed_records': duplicate.get('processed_records', duplicate.get('total_records', 0)),
+            'book_ids': duplicate.get('book_ids', []),
+            'created_book_ids': duplicate.get('created_book_ids', []),
+            'duplicate_of': duplicate['_id']
+        })
+        mongo.db.uploads.insert_one(upload_record)
+        logger.info(f"文件 {filename} 与已处理的上传 {duplicate['_id']} 内容相同，直接复用结果")
+        return {
+            'file_id': str(file_id),
+            'queue_position': None,
+            'duplicate_of': str(duplicate['_id'])
+        }
+    
+    # 入队序号决定处理顺序和排队位置
+    upload_record['enqueue_seq'] = next_enqueue_seq()
+    mongo.db.uploads.insert_one(upload_record)
+    logger.info(f"已创建上传记录: {file_id}, 入队序号: {upload_record['enqueue_seq']}")
+    
+    # 管理上传队列
+    manage_upload_queue()
+    queue_position = get_queue_position(mongo.db.uploads.find_one({'_id': file_id}, {'status': 1, 'enqueue_seq': 1}))
+    return {
+        'file_id': str(file_id),
+        'queue_position': queue_position,
+        'duplicate_of': None
+    }
+
+def ensure_upload_indexes():
+    """创建上传队列及结果清理相关的索引，重复调用不会产生影响"""
+    try:
+        mongo.db.uploads.create_index([('content_hash', 1), ('status', 1)])
+        # 认领任务和计算排队位置时按状态过滤并按入队序号排序
+        mongo.db.uploads.create_index([('status', 1), ('enqueue_seq', 1)])
+        # 回收过期任务时按状态和租约到期时间查询
+        mongo.db.uploads.create_index([('status', 1), ('lease_expires_at', 1)])
+        # 删除上传时检查其结果是否仍被复用它的重复上传引用
+        mongo.db.uploads.create_index([('duplicate_of', 1)])
+        # 重试和取消任务时按上传记录ID清理评论，书籍信息按book_id覆盖写入
+        mongo.db.comments_tags.create_index([('upload_id', 1)])
+        mongo.db.books_info.create_index([('book_id', 1)])
+    except Exception as e:
+        logger.warning(f"创建上传记录索引失败: {str(e)}")
 
 def process_upload_complete(file_id):
-    """处理完成后的操作"""
+    """任务结束(完成或失败)后的操作：用空出的槽位启动下一个任务"""
     try:
-        # 更新当前文件状态为完成
-        mongo.db.uploads.update_one(
-            {'_id': ObjectId(file_id)},
-            {
-                '$set': {
-                    'status': 'completed',
-                    'queue_position': None,
-                    'last_updated': get_current_time()
-                }
-            }
-        )
-        
-        # 获取下一个待处理的任务（队列位置为2的任务）
-        next_task = mongo.db.uploads.find_one(
-            {'status': 'queued', 'queue_position': 2}
-        )
-        
-        if next_task:
-            # 更新下一个任务的状态为处理中，位置为1
-            mongo.db.uploads.update_one(
-                {'_id': next_task['_id']},
-                {
-                    '$set': {
-                        'status': 'processing',
-                        'queue_position': 1,
-                        'last_updated': get_current_time()
-                    }
-                }
-            )
-            
-            # 更新其他排队任务的位置（位置-1）
-            mongo.db.uploads.update_many(
-                {
-                    'status': 'queued',
-                    'queue_position': {'$gt': 2}  # 位置大于2的任务
-                },
-                {
-                    '$inc': {'queue_position': -1}  # 位置减1
-                }
-            )
-            
-            # 启动下一个文件的处理
-            file_id = str(next_task['_id'])
-            filename = next_task['filename']
-            #开始处理
-            run_spark_algorithm(file_id, filename)
+        # 由队列调度器按并发上限启动后续任务，每个任务都在独立线程中运行
+        manage_upload_queue()
             
     except Exception as e:
-        logger.error(f"更新处理完成状态时发生错误: {str(e)}")
+        logger.error(f"任务 {file_id} 结束后调度队列时发生错误: {str(e)}")
 
-def process_file_async(file_id: str, filename: str):
+def process_file_async(file_id: str, filename: str, lease_owner: Optional[str] = None):
     """
     异步处理文件
     """
@@ -514,28 +1104,30 @@ def process_file_async(file_id: str, filename: str):
         # 检查文件状态
         if file_info['status'] not in ['queued', 'processing']:
             raise Exception(f"文件状态不正确: {file_info['status']}")
+        if lease_owner and file_info.get('lease_owner') != lease_owner:
+            raise Exception(f"任务已被重新认领: {file_info.get('lease_owner')}")
+        
+        # 启动异步处理线程，线程内保持应用上下文以便任务结束后继续调度队列
+        app = current_app._get_current_object()
+        
+        def run_in_app_context():
+            with app.app_context():
+                run_spark_algorithm(file_id, filename, lease_owner=lease_owner)
         
-        # 启动异步处理线程
-        thread = Thread(target=run_spark_algorithm, args=(file_id, filename))
+        thread = Thread(target=run_in_app_context)
         thread.daemon = True
         thread.start()
         
-        logger.info(f"已启动异步处理线程，文件ID: {file_id}, 文件名: {filename}")
+        logger.info(f"已启动异步处理线程，文件ID: {file_id}, 文件名: {filename}, 租约: {lease_owner}")
         
     except Exception as e:
         error_msg = f"启动处理失败: {str(e)}"
         logger.error(error_msg)
         # 更新上传记录状态为失败
-        mongo.db.uploads.update_one(
-            {'_id': ObjectId(file_id)},
-            {
-                '$set': {
-                    'status': 'failed',
-                    'error_message': error_msg,
-                    'queue_position': None,
-                    'last_updated': get_current_time()
-                }
-            }
-        )
+        if not release_upload(file_id, lease_owner, {
+            'status': 'failed',
+            'error_message': error_msg
+        }):
+            return
         # 如果当前任务失败，尝试处理队列中的下一个任务
-        manage_upload_queue()
\ No newline at end of file
+        manage_upload_queue()
@@ -0,0 +1,115 @@
+import signal
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from app.utils import (
+    get_current_time,
+    get_worker_id,
+    claim_next_upload,
+    get_stored_filename,
+    release_upload,
+    reap_expired_uploads,
+    load_algorithm_module,
+    run_spark_algorithm
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UploadWorker:
+    """
+    独立的上传分析进程
+
+    从 uploads 集合中按租约认领排队任务并在本进程内运行分析，
+    Spark 会话和 HanLP 模型只在本进程中加载一次，Web进程只负责入队和展示状态。
+    进度与最终状态都写回上传记录，租约过期的任务由本进程和Web进程的定时任务共同回收。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.concurrency = app.config['UPLOAD_WORKER_CONCURRENCY']
+        self.lease_seconds = app.config['UPLOAD_LEASE_SECONDS']
+        self.poll_seconds = app.config['UPLOAD_WORKER_POLL_SECONDS']
+        self.reaper_interval = app.config['UPLOAD_REAPER_INTERVAL_SECONDS']
+        self.worker_id = get_worker_id()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._running = set()
+        self._running_lock = Lock()
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._last_reap = None
+
+    def stop(self, *args):
+        """停止认领新任务，已在运行的任务会处理完再退出"""
+        logger.info("收到退出信号，等待正在处理的任务结束")
+        self._stopping.set()
+        self._wakeup.set()
+
+    def run(self):
+        """主循环：回收过期任务、认领排队任务，直到收到退出信号"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # 启动时预先初始化分析引擎，第一个任务不必等待会话创建和模型加载
+        load_algorithm_module(self.app.config['ALGORITHM_DIR']).get_engine()
+        logger.info(f"分析worker已启动: {self.worker_id}, 并发数: {self.concurrency}")
+
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self._reap_if_due()
+                    self._claim_jobs()
+            except Exception as e:
+                logger.error(f"worker调度任务时发生错误: {str(e)}")
+
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+        self._executor.shutdown(wait=True)
+        logger.info("分析worker已退出")
+
+    def _reap_if_due(self):
+        now = get_current_time()
+        if self._last_reap and (now - self._last_reap).total_seconds() < self.reaper_interval:
+            return
+        self._last_reap = now
+        reap_expired_uploads(
+            self.app.config['UPLOAD_MAX_ATTEMPTS'],
+            self.app.config['UPLOAD_RETRY_BACKOFF_SECONDS']
+        )
+
+    def _claim_jobs(self):
+        while not self._stopping.is_set():
+            with self._running_lock:
+                if len(self._running) >= self.concurrency:
+                    return
+            task = claim_next_upload(self.worker_id, self.lease_seconds)
+            if not task:
+                return
+
+            file_id = str(task['_id'])
+            with self._running_lock:
+                self._running.add(file_id)
+            try:
+                future = self._executor.submit(
+                    self._run_job, file_id, get_stored_filename(task), task['lease_owner']
+                )
+            except Exception as e:
+                self._job_done(file_id)
+                release_upload(file_id, task['lease_owner'], {
+                    'status': 'failed',
+                    'error_message': f"启动处理失败: {str(e)}"
+                })
+                raise
+            future.add_done_callback(lambda _, file_id=file_id: self._job_done(file_id))
+            logger.info(f"已认领任务 {file_id}({task.get('filename')})")
+
+    def _run_job(self, file_id: str, filename: str, lease_owner: str):
+        with self.app.app_context():
+            run_spark_algorithm(file_id, filename, lease_owner=lease_owner)
+
+    def _job_done(self, file_id: str):
+        # 任务结束后立即唤醒主循环认领下一个任务
+        with self._running_lock:
+            self._running.discard(file_id)
+        self._wakeup.set()
@@ -11,13 +11,50 @@ class Config:
     # 文件大小限制
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max-limit
     
+    # 分块上传配置：单个分块受 MAX_CONTENT_LENGTH 限制，整个文件受 MAX_CHUNKED_UPLOAD_SIZE 限制
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+    MAX_CHUNKED_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
+    UPLOAD_CHUNK_FOLDER = os.path.join(UPLOAD_FOLDER, 'chunks')
+    UPLOAD_SESSION_TTL_HOURS = 24  # 未完成的分块上传会话保留时间
+    
+    # CSV分块校验时每块读取的行数
+    CSV_CHUNK_SIZE = 10000
+    
     # HDFS配置
     HDFS_HOST = 'master'
     HDFS_PORT = 9000
     HDFS_USER = 'root'
+    HDFS_WEB_PORT = 9870  # WebHDFS端口
+    HDFS_INPUT_DIR = '/input_data'
+    HDFS_POOL_SIZE = 8  # WebHDFS连接池大小
+    
+    # 存储后端: 'hdfs' 使用WebHDFS客户端，'local' 使用本地目录(测试用)
+    STORAGE_BACKEND = 'hdfs'
+    LOCAL_STORAGE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
     
     # Spark配置
     SPARK_MASTER = 'spark://master:7077'
+    # 上传任务的执行方式：'worker' 由独立的 worker.py 进程处理，Web进程只负责入队；
+    # 'inline' 在Web进程的后台线程中处理，仅用于单机调试
+    UPLOAD_EXECUTION_MODE = 'worker'
+    # worker 没有被任务结束唤醒时，轮询排队任务的间隔(秒)
+    UPLOAD_WORKER_POLL_SECONDS = 5
+    # 算法文件(algorithm.py 及其 config.py)所在目录
+    ALGORITHM_DIR = '/opt/notebooks'
+    # 排队任务的调度策略：'fifo' 先进先出；'sjf' 按 total_records 短作业优先，并随等待时间老化
+    UPLOAD_SCHEDULER_POLICY = 'sjf'
+    # sjf 策略下每等待一分钟，任务的得分(记录数)降低的数量，保证大文件最终也会被调度
+    UPLOAD_SJF_AGING_RECORDS_PER_MINUTE = 10000
+    # 同时处理的上传任务数，建议与可用的Spark executor数量相匹配
+    UPLOAD_WORKER_CONCURRENCY = 2
+    # 任务租约时长(秒)，处理中的任务需在租约到期前发送心跳续约
+    UPLOAD_LEASE_SECONDS = 300
+    UPLOAD_HEARTBEAT_SECONDS = 60
+    # 租约过期(进程崩溃或重启)的任务最多重试的次数，以及重试退避的基准秒数(按次数翻倍)
+    UPLOAD_MAX_ATTEMPTS = 3
+    UPLOAD_RETRY_BACKOFF_SECONDS = 60
+    # 回收过期任务并调度队列的间隔(秒)
+    UPLOAD_REAPER_INTERVAL_SECONDS = 60
     JUPYTER_HOST = 'jupyter'
 
     # 讯飞星火API配置 (HTTP调用)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Web应用以 book_system 目录为导入根目录(import app / config)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,89 @@
+"""删除上传记录时清理其结果数据(purge_upload_results)的测试"""
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("flask_pymongo")
+mongomock = pytest.importorskip("mongomock")
+
+from app import mongo
+from app.utils import purge_upload_results
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(mongo, "db", database, raising=False)
+    return database
+
+
+def add_upload(db, content_hash="hash-1", created_book_ids=None, duplicate_of=None):
+    upload = {
+        "_id": ObjectId(),
+        "status": "completed",
+        "content_hash": content_hash,
+        "book_ids": ["1"],
+        "created_book_ids": created_book_ids if created_book_ids is not None else ["1"],
+    }
+    if duplicate_of:
+        upload["duplicate_of"] = duplicate_of
+    db.uploads.insert_one(upload)
+    return upload
+
+
+def add_comments(db, upload, count, book_id="1"):
+    db.comments_tags.insert_many([
+        {"comment_id": f"{upload['_id']}-{i}", "book_id": book_id, "upload_id": str(upload["_id"])}
+        for i in range(count)
+    ])
+
+
+def delete_upload(db, upload):
+    """与删除接口相同：先删除上传记录，再清理它的结果"""
+    db.uploads.delete_one({"_id": upload["_id"]})
+    return purge_upload_results(upload)
+
+
+def test_independent_uploads_of_same_content_purge_only_their_own_rows(db):
+    db.books_info.insert_one({"book_id": "1", "book_title": "活着"})
+    first = add_upload(db)
+    second = add_upload(db)
+    add_comments(db, first, 3)
+    add_comments(db, second, 2)
+
+    assert delete_upload(db, first) == 0
+
+    assert db.comments_tags.count_documents({"upload_id": str(first["_id"])}) == 0
+    assert db.comments_tags.count_documents({"upload_id": str(second["_id"])}) == 2
+    # 另一次上传的评论仍引用这本书
+    assert db.books_info.count_documents({"book_id": "1"}) == 1
+
+    assert delete_upload(db, second) == 1
+
+    assert db.comments_tags.count_documents({}) == 0
+    assert db.books_info.count_documents({}) == 0
+
+
+def test_results_are_kept_while_a_duplicate_still_references_them(db):
+    db.books_info.insert_one({"book_id": "1", "book_title": "活着"})
+    original = add_upload(db)
+    duplicate = add_upload(db, duplicate_of=original["_id"])
+    add_comments(db, original, 3)
+
+    assert delete_upload(db, original) == 0
+    assert db.comments_tags.count_documents({"upload_id": str(original["_id"])}) == 3
+
+    # 最后一个引用这些结果的记录被删除时才清理
+    assert delete_upload(db, duplicate) == 1
+    assert db.comments_tags.count_documents({}) == 0
+    assert db.books_info.count_documents({}) == 0
+
+
+def test_existing_books_reused_by_the_upload_are_kept(db):
+    db.books_info.insert_one({"book_id": "1", "book_title": "活着"})
+    upload = add_upload(db, created_book_ids=[])
+    add_comments(db, upload, 2)
+
+    assert delete_upload(db, upload) == 0
+
+    assert db.comments_tags.count_documents({}) == 0
+    assert db.books_info.count_documents({"book_id": "1"}) == 1
@@ -0,0 +1,6 @@
+from app import create_app
+from app.worker import UploadWorker
+
+app = create_app(start_scheduler=False)
+if __name__ == '__main__':
+    UploadWorker(app).run()
@@ -1,22 +1,36 @@
 import os
 import sys
+import json
 import logging
-import hanlp
+import re
 import time
+import threading
 import jiagu
+import pandas as pd
+import nlp_models
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, udf, lit
+from pyspark.sql.functions import col, udf, lit, pandas_udf, sha2, concat, struct
 from config import TAGS_MONGO_URI, MONGO_DATABASE, TAGS_OUTPUT_COLLECTION,BOOK_INFO_COLLECTION
+from config import HDFS_BASE, INPUT_DIR, PARQUET_DIR
+from config import NLP_EXECUTION_MODE, NLP_ARROW_BATCH_SIZE, HANLP_BATCH_SIZE, HANLP_MODEL, HANLP_HOME
+from config import HANLP_PROFILES, HANLP_PROFILE
+from config import ANALYSIS_CACHE_ENABLED, ANALYSIS_CACHE_COLLECTION, ANALYSIS_VERSION, ANALYSIS_CACHE_LOOKUP_BATCH
+from config import ANALYSIS_CACHE_LOOKUP_MAX_KEYS
 from pyspark.sql.types import ArrayType, StringType, StructType, StructField
 
 # 设置环境变量
 os.environ['PYSPARK_PYTHON'] = sys.executable
 os.environ['PYSPARK_DRIVER_PYTHON'] = sys.executable
+# 每个Python线程对应固定的JVM线程，setJobGroup 才能按任务线程生效，从而按任务取消
+os.environ.setdefault('PYSPARK_PIN_THREAD', 'true')
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class JobCancelled(Exception):
+    """任务已被取消"""
+
 def get_base_schema():
     """获取基础schema(必需的列)"""
     return StructType([
@@ -47,7 +61,7 @@ def read_csv_with_schema(spark, hdfs_path):
     from pyspark.sql.functions import col, lit
     
     try:
-        # 1. 读取并获取实际的列
+        # 1. 读取数据并获取实际的列(表头只解析一次，后续直接在同一个DataFrame上选择列)
         raw_df = spark.read.csv(
             hdfs_path,
             header=True,
@@ -68,16 +82,7 @@ def read_csv_with_schema(spark, hdfs_path):
         full_schema = get_full_schema()
         expected_columns = [field.name for field in full_schema.fields]
         
-        # 4. 读取数据并处理列
-        df = spark.read.csv(
-            hdfs_path,
-            header=True,
-            multiLine=True,
-            escape='"',
-            sep=','
-        )
-        
-        # 5. 选择列并补充缺失列
+        # 4. 选择列并补充缺失列
         selected_cols = []
         for expected_col in expected_columns:
             if expected_col in actual_columns:
@@ -85,13 +90,60 @@ def read_csv_with_schema(spark, hdfs_path):
             else:
                 selected_cols.append(lit(None).cast(StringType()).alias(expected_col))
         
-        # 6. 返回最终的DataFrame
-        return df.select(*selected_cols)
+        # 5. 返回最终的DataFrame
+        return raw_df.select(*selected_cols)
         
     except Exception as e:
         logger.error(f"读取CSV文件失败: {str(e)}")
         raise
 
+def get_parquet_path(input_file, attempt_id=None):
+    """
+    获取上传文件对应的Parquet数据集路径
+
+    同一文件的多次处理尝试(如租约过期后的重试)各自使用带 attempt_id 的路径，
+    被回收但尚未停止的旧尝试不会覆盖或删除新尝试的暂存数据。
+    """
+    if attempt_id:
+        # HDFS路径中不能包含冒号等字符
+        return f"{PARQUET_DIR}/{input_file}.{re.sub(r'[^0-9A-Za-z_-]', '_', attempt_id)}.parquet"
+    return f"{PARQUET_DIR}/{input_file}.parquet"
+
+def convert_to_parquet(spark, input_file, attempt_id=None):
+    """
+    导入阶段：将上传的CSV只解析一次，转换为符合 get_full_schema() 的Parquet数据集，
+    后续所有Spark阶段都读取该数据集，不再重复解析多行CSV
+    """
+    csv_path = f"{INPUT_DIR}/{input_file}"
+    parquet_path = get_parquet_path(input_file, attempt_id)
+    logger.info(f"将 {csv_path} 转换为Parquet: {parquet_path}")
+    
+    df = read_csv_with_schema(spark, csv_path)
+    df.write.mode("overwrite").parquet(parquet_path)
+    
+    logger.info(f"Parquet数据集已生成: {parquet_path}")
+    return parquet_path
+
+def get_batches_path(parquet_path):
+    """获取大数据集分批处理时按批次分区的暂存数据集路径"""
+    return f"{parquet_path}_batches"
+
+def read_input_dataset(spark, parquet_path):
+    """读取导入阶段生成的Parquet数据集"""
+    return spark.read.schema(get_full_schema()).parquet(parquet_path)
+
+def remove_hdfs_path(spark, path):
+    """通过Hadoop FileSystem API递归删除HDFS路径"""
+    try:
+        jvm = spark.sparkContext._jvm
+        hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+        fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+        if fs.exists(hadoop_path):
+            fs.delete(hadoop_path, True)
+            logger.info(f"已删除HDFS路径: {path}")
+    except Exception as e:
+        logger.warning(f"删除HDFS路径 {path} 失败: {str(e)}")
+
 def get_mongodb_config():
     """获取MongoDB配置"""
     mongo_uri = (
@@ -108,13 +160,14 @@ def create_spark_session():
     # 根据数据量调整Spark配置
     return SparkSession.builder \
         .appName("SentimentAnalysis") \
-        .config("spark.hadoop.fs.defaultFS", "hdfs://master:9000") \
+        .config("spark.hadoop.fs.defaultFS", HDFS_BASE) \
         .config("spark.driver.memory", "2G") \
         .config("spark.executor.cores", "2") \
         .config("spark.executor.instances", "4") \
         .config("spark.executor.memory", "1G") \
         .config("spark.default.parallelism", "8") \
         .config("spark.sql.shuffle.partitions", "8") \
+        .config("spark.scheduler.mode", "FAIR") \
         .config("spark.serializer", "org.apache.spark.serializer.KryoSerializer") \
         .config("spark.mongodb.input.uri", mongo_uri) \
         .config("spark.mongodb.output.uri", mongo_uri) \
@@ -128,19 +181,13 @@ def create_spark_session():
         .config("spark.memory.fraction", "0.6") \
         .config("spark.memory.storageFraction", "0.5") \
         .config("spark.cleaner.periodicGC.interval", "1min") \
+        .config("spark.sql.execution.arrow.maxRecordsPerBatch", str(NLP_ARROW_BATCH_SIZE)) \
         .getOrCreate()
 
-# 创建 Spark 会话
-spark = create_spark_session()
-
-# 加载模型和创建广播变量
-HanLP = hanlp.load(hanlp.pretrained.mtl.CLOSE_TOK_POS_NER_SRL_DEP_SDP_CON_ELECTRA_SMALL_ZH)
-HanLP_broadcast = spark.sparkContext.broadcast(HanLP)
-
-# 从HDFS读取stopwords
-stopwords_df = spark.read.text("hdfs://master:9000/input_data/stopwords.txt")
-stopwords = set(stopwords_df.rdd.map(lambda r: r[0]).collect())
-broadcast_stopwords = spark.sparkContext.broadcast(stopwords)
+def load_stopwords(spark):
+    """从HDFS读取stopwords"""
+    stopwords_df = spark.read.text(f"{INPUT_DIR}/stopwords.txt")
+    return set(stopwords_df.rdd.map(lambda r: r[0]).collect())
 
 def extract_keywords(text, top_n=5):
     """使用jiagu提取文本关键词"""
@@ -181,67 +228,80 @@ def generate_summary(text, num_sentences=2):
         logger.debug(f"问题文本: {text[:100]}...")
         return text.strip()
 
-def extract_labels(text, keywords):
+# extract_labels 使用的HanLP任务，由分析档位决定
+LABEL_TASKS = HANLP_PROFILES[HANLP_PROFILE]
+
+def build_labels(words, pos_tags, sdp, keywords):
+    """根据分词、词性和语义依存结果生成标签"""
+    tags = set()
+    
+    # 1. 优先添加关键词
+    tags.update(keywords)
+    
+    # 2. 提取语义依存关系
+    for i, word_relations in enumerate(sdp):
+        for relation in word_relations:
+            if isinstance(relation, tuple) and len(relation) == 2:
+                head, rel = relation
+                if head != 0:  # 跳过根节点
+                    head_word = words[head - 1]
+                    current_word = words[i]
+                    
+                    if pos_tags[i].startswith(('N', 'V', 'JJ')) or pos_tags[head-1].startswith(('N', 'V', 'JJ')):
+                        if rel in ['Exp', 'Cont', 'Datv', 'eResu', 'ePurp', 'eCau']:
+                            tag = head_word + current_word
+                        elif rel in ['Desc', 'mNeg', 'mDegr', 'mMod', 'mFreq', 'mTime', 'mScope', 'mPoss']:
+                            tag = current_word + head_word
+                        else:
+                            continue
+                        
+                        if 2 <= len(tag) <= 8 and (tag in keywords or any(word in keywords for word in tag)):
+                            tags.add(tag)
+    
+    # 3. 提取连续的名词短语
+    for i in range(len(words) - 1):
+        if pos_tags[i].startswith('N') and pos_tags[i+1].startswith('N'):
+            tag = words[i] + words[i+1]
+            if 2 <= len(tag) <= 8:
+                tags.add(tag)
+    
+    # 4. 标签精简和去重
+    final_tags = set()
+    for tag in tags:
+        if isinstance(tag, str) and 2 <= len(tag) <= 8 and not any(punct in tag for punct in ['，', '。', '：', '；', '、']):
+            final_tags.add(tag)
+    
+    # 5. 返回结果
+    return list(final_tags)[:10]  # 返回10个标签
+
+def extract_labels(text, keywords, local_HanLP):
     """使用HanLP提取文本标签"""
     try:
-        local_HanLP = HanLP_broadcast.value
-        doc = local_HanLP(text, tasks=['tok/fine', 'pos/ctb', 'dep', 'sdp'])
-        tags = set()
-        
-        words = doc['tok/fine']
-        pos_tags = doc['pos/ctb']
-        sdp = doc['sdp']
-        
-        # 1. 优先添加关键词
-        tags.update(keywords)
-        
-        # 2. 提取语义依存关系
-        for i, word_relations in enumerate(sdp):
-            for relation in word_relations:
-                if isinstance(relation, tuple) and len(relation) == 2:
-                    head, rel = relation
-                    if head != 0:  # 跳过根节点
-                        head_word = words[head - 1]
-                        current_word = words[i]
-                        
-                        if pos_tags[i].startswith(('N', 'V', 'JJ')) or pos_tags[head-1].startswith(('N', 'V', 'JJ')):
-                            if rel in ['Exp', 'Cont', 'Datv', 'eResu', 'ePurp', 'eCau']:
-                                tag = head_word + current_word
-                            elif rel in ['Desc', 'mNeg', 'mDegr', 'mMod', 'mFreq', 'mTime', 'mScope', 'mPoss']:
-                                tag = current_word + head_word
-                            else:
-                                continue
-                            
-                            if 2 <= len(tag) <= 8 and (tag in keywords or any(word in keywords for word in tag)):
-                                tags.add(tag)
-        
-        # 3. 提取连续的名词短语
-        for i in range(len(words) - 1):
-            if pos_tags[i].startswith('N') and pos_tags[i+1].startswith('N'):
-                tag = words[i] + words[i+1]
-                if 2 <= len(tag) <= 8:
-                    tags.add(tag)
-        
-        # 4. 标签精简和去重
-        final_tags = set()
-        for tag in tags:
-            if isinstance(tag, str) and 2 <= len(tag) <= 8 and not any(punct in tag for punct in ['，', '。', '：', '；', '、']):
-                final_tags.add(tag)
-        
-        # 5. 返回结果
-        return list(final_tags)[:10]  # 返回10个标签
+        doc = local_HanLP(text, tasks=LABEL_TASKS)
+        return build_labels(doc['tok/fine'], doc['pos/ctb'], doc.get('sdp', []), keywords)
     except Exception as e:
         logger.error(f"标签提取失败: {str(e)}")
         return []
 
-@udf(StructType([
-    StructField("jiagu_summary", StringType()),
-    StructField("keywords", ArrayType(StringType())),
-    StructField("labels", ArrayType(StringType())),
-    StructField("sentiment", StringType())
-]))
-def process_text(text):
-    """处理文本的UDF函数"""
+def extract_labels_batch(texts, keywords_list, local_HanLP):
+    """
+    一次调用HanLP批量提取多条文本的标签，由模型内部按 HANLP_BATCH_SIZE 组批推理
+    
+    批量推理失败时逐条回退到 extract_labels。
+    """
+    try:
+        doc = local_HanLP(texts, tasks=LABEL_TASKS, batch_size=HANLP_BATCH_SIZE)
+        sdp_list = doc.get('sdp') or [[] for _ in texts]
+        return [
+            build_labels(words, pos_tags, sdp, keywords)
+            for words, pos_tags, sdp, keywords in zip(doc['tok/fine'], doc['pos/ctb'], sdp_list, keywords_list)
+        ]
+    except Exception as e:
+        logger.warning(f"批量标签提取失败，逐条处理: {str(e)}")
+        return [extract_labels(text, keywords, local_HanLP) for text, keywords in zip(texts, keywords_list)]
+
+def analyze_text(text, local_HanLP):
+    """分析单条文本，返回 (摘要, 关键词, 标签, 情感)"""
     if not text or not isinstance(text, str):
         logger.warning("输入文本为空或非字符串类型")
         return ("", [], [], "")
@@ -249,7 +309,7 @@ def process_text(text):
     try:
         keywords = extract_keywords(text)
         summary = generate_summary(text)
-        labels = extract_labels(summary, keywords)
+        labels = extract_labels(summary, keywords, local_HanLP)
         
         sentiment = jiagu.sentiment(text)
         sentiment_label = "正面" if sentiment[0] == "positive" else "负面"
@@ -259,17 +319,357 @@ def process_text(text):
         logger.error(f"文本处理失败: {str(e)}")
         return ("", [], [], "")
 
-def process_and_write_to_mongodb(spark, input_file, batch_size=500):
-    """采用分布式读写架构处理CSV文件并将结果写入MongoDB"""
+def analyze_texts(texts, local_HanLP):
+    """
+    批量分析一组文本，结果与逐条调用 analyze_text 相同
+    
+    关键词、摘要和情感仍逐条计算(jiagu没有批量接口)，HanLP对所有非空摘要只调用一次。
+    """
+    results = [("", [], [], "")] * len(texts)
+    prepared = []
+    for index, text in enumerate(texts):
+        if not text or not isinstance(text, str):
+            continue
+        try:
+            keywords = extract_keywords(text)
+            summary = generate_summary(text)
+            sentiment = jiagu.sentiment(text)
+            sentiment_label = "正面" if sentiment[0] == "positive" else "负面"
+            prepared.append((index, summary, keywords, sentiment_label))
+        except Exception as e:
+            logger.error(f"文本处理失败: {str(e)}")
+    
+    batch = [item for item in prepared if item[1]]
+    batch_labels = extract_labels_batch(
+        [summary for _, summary, _, _ in batch],
+        [keywords for _, _, keywords, _ in batch],
+        local_HanLP
+    ) if batch else []
+    labels_by_index = {item[0]: labels for item, labels in zip(batch, batch_labels)}
+    
+    for index, summary, keywords, sentiment_label in prepared:
+        labels = labels_by_index.get(index)
+        if labels is None:
+            labels = extract_labels(summary, keywords, local_HanLP)
+        results[index] = (summary, keywords, labels, sentiment_label)
+    return results
+
+# process_text 输出的结构，逐行UDF和pandas UDF保持一致
+PROCESSED_TEXT_SCHEMA = StructType([
+    StructField("jiagu_summary", StringType()),
+    StructField("keywords", ArrayType(StringType())),
+    StructField("labels", ArrayType(StringType())),
+    StructField("sentiment", StringType())
+])
+
+def create_process_text_udf(hanlp_model=HANLP_MODEL, progress=None, mode=NLP_EXECUTION_MODE):
+    """
+    创建处理文本的UDF，模型由每个executor的Python worker按需加载并在任务之间复用
+    
+    Args:
+        hanlp_model: HanLP预训练模型名
+        progress: 可选的累加器，每处理一条记录加1，任务完成后在driver上可见
+        mode: "pandas_udf" 通过Arrow按批传输并批量调用HanLP；"udf" 逐行处理
+    """
+    if mode == "pandas_udf":
+        @pandas_udf(PROCESSED_TEXT_SCHEMA)
+        def process_text_batch(texts: pd.Series) -> pd.DataFrame:
+            """按Arrow批次处理文本的pandas UDF"""
+            if progress is not None:
+                progress.add(len(texts))
+            results = analyze_texts(texts.tolist(), nlp_models.get_hanlp(hanlp_model, HANLP_HOME, LABEL_TASKS))
+            return pd.DataFrame(results, columns=[field.name for field in PROCESSED_TEXT_SCHEMA.fields])
+        
+        return process_text_batch
+    
+    if mode != "udf":
+        raise ValueError(f"不支持的NLP执行方式: {mode}")
+    
+    @udf(PROCESSED_TEXT_SCHEMA)
+    def process_text(text):
+        """处理文本的UDF函数"""
+        if progress is not None:
+            progress.add(1)
+        return analyze_text(text, nlp_models.get_hanlp(hanlp_model, HANLP_HOME, LABEL_TASKS))
+    
+    return process_text
+
+# 分析结果列，以及写入 comments_tags 的评论列
+ANALYSIS_COLUMNS = [field.name for field in PROCESSED_TEXT_SCHEMA.fields]
+COMMENT_COLUMNS = ["book_id", "comment_id", "content"] + ANALYSIS_COLUMNS
+
+def get_analysis_version():
+    """分析结果的版本标识，分析逻辑、模型或分析档位变化后缓存的旧结果不再命中"""
+    return f"{ANALYSIS_VERSION}:{HANLP_MODEL}:{HANLP_PROFILE}"
+
+def load_analysis_cache(spark, pipeline, partitioner=None):
+    """按聚合管道读取缓存集合，返回 _id 和分析结果列"""
+    cache_schema = StructType([StructField("_id", StringType())] + PROCESSED_TEXT_SCHEMA.fields)
+    reader = spark.read \
+        .format("mongodb") \
+        .option("database", MONGO_DATABASE) \
+        .option("collection", ANALYSIS_CACHE_COLLECTION) \
+        .option("aggregation.pipeline", json.dumps(pipeline))
+    if partitioner:
+        reader = reader.option("partitioner", partitioner)
+    return reader.schema(cache_schema).load()
+
+def read_analysis_cache(spark, content_keys=None, analysis_version=None):
+    """
+    读取缓存结果，返回 content_key 和 cached_analysis 两列
+    
+    给定 content_keys 时，每次读取只用 _id 的 $in 条件在MongoDB端按主键索引查找本次任务涉及的键，
+    查询代价与上传的评论数相关，而与缓存集合的总大小无关，键较多时分成多次查询后合并；
+    否则按默认分区器并行读取 analysis_version 版本的全部缓存结果。
+    """
+    if content_keys is None:
+        cached = load_analysis_cache(spark, [{"$match": {"analysis_version": analysis_version}}])
+    else:
+        cached = None
+        for start in range(0, len(content_keys), ANALYSIS_CACHE_LOOKUP_BATCH):
+            pipeline = [{"$match": {"_id": {"$in": content_keys[start:start + ANALYSIS_CACHE_LOOKUP_BATCH]}}}]
+            # 查询已限定在少量主键上，不需要对整个集合采样分区
+            lookup = load_analysis_cache(
+                spark, pipeline,
+                "com.mongodb.spark.sql.connector.read.partitioner.SinglePartitionPartitioner"
+            )
+            cached = lookup if cached is None else cached.unionByName(lookup)
+    
+    return cached.select(
+        col("_id").alias("content_key"),
+        struct(*[col(name) for name in ANALYSIS_COLUMNS]).alias("cached_analysis")
+    )
+
+def attach_cached_analysis(spark, df, use_cache=ANALYSIS_CACHE_ENABLED):
+    """
+    为每条评论计算内容键，并与分析缓存做一次批量关联
+    
+    内容键为 分析版本 + 评论内容 的SHA-256，返回的DataFrame增加 content_key 和 cached_analysis 列，
+    未命中缓存(或未启用缓存)的评论 cached_analysis 为空。
+    """
+    analysis_version = get_analysis_version()
+    df = df.withColumn(
+        "content_key",
+        sha2(concat(lit(analysis_version + "\x1f"), col("content")), 256)
+    )
+    content_keys = []
+    if use_cache:
+        # 最多只收集上限+1个键到driver，用于判断是否超过上限
+        content_keys = [
+            row.content_key
+            for row in df.select("content_key").distinct().limit(ANALYSIS_CACHE_LOOKUP_MAX_KEYS + 1).collect()
+        ]
+    if not content_keys:
+        return df.withColumn("cached_analysis", lit(None).cast(PROCESSED_TEXT_SCHEMA))
+    if len(content_keys) > ANALYSIS_CACHE_LOOKUP_MAX_KEYS:
+        # 不同内容过多时按主键分批查询的次数过多，改为读取当前版本的整个缓存，在Spark中关联
+        logger.info(f"不同评论内容超过 {ANALYSIS_CACHE_LOOKUP_MAX_KEYS} 条，与整个分析缓存关联")
+        cached = read_analysis_cache(spark, analysis_version=analysis_version)
+    else:
+        cached = read_analysis_cache(spark, content_keys)
+    return df.join(cached, "content_key", "left")
+
+def analyze_comments(df, process_text, num_partitions):
+    """
+    分析评论，命中缓存的评论直接使用缓存结果，只有未命中的评论交给 process_text 处理
+    
+    未命中的评论按 content_key 去重，相同内容(复制粘贴、刷评)只分析一次，再关联回所有评论。
+    
+    Args:
+        df: attach_cached_analysis 返回的DataFrame
+        process_text: create_process_text_udf 创建的UDF
+        num_partitions: 未命中评论按book_id重新分区的分区数
+    
+    Returns:
+        包含 COMMENT_COLUMNS、content_key 和 from_cache 列的DataFrame
+    """
+    hits = df.filter(col("cached_analysis").isNotNull()) \
+        .withColumn("processed_text", col("cached_analysis")) \
+        .withColumn("from_cache", lit(True))
+    
+    misses = df.filter(col("cached_analysis").isNull())
+    
+    # 处理文本内容 - 这一步在Spark Workers上并行执行，每种不同的内容只处理一次
+    analyzed = misses.select("book_id", "content_key", "content") \
+        .dropDuplicates(["content_key"]) \
+        .repartitionByRange(num_partitions, "book_id") \
+        .withColumn("processed_text", process_text(col("content"))) \
+        .select("content_key", "processed_text")
+    misses = misses.join(analyzed, "content_key").withColumn("from_cache", lit(False))
+    
+    columns = ["book_id", "comment_id", "content", "content_key", "from_cache", "processed_text"]
+    result_df = hits.select(*columns).unionByName(misses.select(*columns)).select(
+        col("book_id"),
+        col("comment_id"),
+        col("content"),
+        *[col(f"processed_text.{name}").alias(name) for name in ANALYSIS_COLUMNS],
+        col("content_key"),
+        col("from_cache")
+    )
+    
+    # 过滤掉空值
+    return result_df.filter(
+        col("jiagu_summary").isNotNull() & 
+        col("sentiment").isNotNull()
+    )
+
+def write_analysis_cache(result_df, use_cache=ANALYSIS_CACHE_ENABLED):
+    """
+    将本次新分析的结果按 content_key 覆盖写入分析缓存，返回写入的条数
+    
+    分析失败的评论(情感为空)不写入缓存，下次仍会重新分析。
+    """
+    if not use_cache:
+        return 0
+    new_results = result_df.filter(~col("from_cache") & (col("sentiment") != "")) \
+        .dropDuplicates(["content_key"]) \
+        .select(
+            col("content_key").alias("_id"),
+            lit(get_analysis_version()).alias("analysis_version"),
+            *ANALYSIS_COLUMNS
+        )
+    new_results.write \
+        .format("mongodb") \
+        .mode("append") \
+        .option("database", MONGO_DATABASE) \
+        .option("collection", ANALYSIS_CACHE_COLLECTION) \
+        .option("operationType", "replace") \
+        .option("upsertDocument", "true") \
+        .option("ordered", "false") \
+        .save()
+    return new_results.count()
+
+def finish_analysis(result_df, progress, timer):
+    """
+    统计缓存命中情况并写入新的分析结果，返回 (有效记录数, 命中缓存的记录数)
+    
+    命中缓存的评论和重复内容的评论不经过UDF，单独计入进度累加器。写入缓存失败不影响本次任务。
+    """
+    stage_start = time.time()
+    processed_count = result_df.count()
+    timer.add("nlp", time.time() - stage_start, processed_count)
+    
+    hit_count = result_df.filter(col("from_cache")).count()
+    analyzed_count = result_df.filter(~col("from_cache")).select("content_key").distinct().count()
+    progress.add(processed_count - analyzed_count)
+    timer.count("cache_hits", hit_count)
+    timer.count("analyzed_contents", analyzed_count)
+    logger.info(
+        f"分析缓存命中 {hit_count}/{processed_count} 条，未命中 {processed_count - hit_count} 条，"
+        f"去重后实际分析 {analyzed_count} 条不同内容"
+    )
+    
+    try:
+        stage_start = time.time()
+        cached_count = write_analysis_cache(result_df)
+        timer.add("analysis_cache_write", time.time() - stage_start, cached_count)
+    except Exception as e:
+        logger.warning(f"写入分析缓存失败: {str(e)}")
+    return processed_count, hit_count
+
+class StageTimer:
+    """
+    累计任务各阶段的耗时和记录数，以及去重、缓存命中等统计数
+    
+    多批次处理时同一阶段和同一统计项会被多次累加，任务结束时按阶段首次出现的顺序汇总回报一次。
+    """
+    
+    def __init__(self, callback=None, stats_callback=None):
+        self.callback = callback
+        self.stats_callback = stats_callback
+        self.stages = {}
+        self.stats = {}
+    
+    def add(self, stage, seconds, records=None):
+        entry = self.stages.setdefault(stage, {'stage': stage, 'seconds': 0.0, 'records': None})
+        entry['seconds'] += seconds
+        if records is not None:
+            entry['records'] = (entry['records'] or 0) + records
+    
+    def count(self, name, value):
+        self.stats[name] = self.stats.get(name, 0) + value
+    
+    def report(self):
+        """以 [{'stage', 'seconds', 'records'}] 的形式回报所有阶段，并以 {统计项: 数量} 回报统计数"""
+        if self.callback and self.stages:
+            try:
+                self.callback([
+                    dict(entry, seconds=round(entry['seconds'], 3)) for entry in self.stages.values()
+                ])
+            except Exception as e:
+                logger.warning(f"回报阶段耗时失败: {str(e)}")
+        if self.stats_callback and self.stats:
+            try:
+                self.stats_callback(dict(self.stats))
+            except Exception as e:
+                logger.warning(f"回报统计数失败: {str(e)}")
+
+# 向调用方回报处理进度的间隔(秒)
+PROGRESS_REPORT_INTERVAL = 5
+
+class ProgressReporter:
+    """
+    定期读取UDF累加器中的已处理记录数并回报给调用方
+    
+    累加器在每个分区任务完成时汇总到driver，因此单批次处理时也能得到分区级的进度。
+    """
+    
+    def __init__(self, accumulator, total_records, callback, interval=PROGRESS_REPORT_INTERVAL):
+        self.accumulator = accumulator
+        self.total_records = total_records
+        self.callback = callback
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.report()
+        self._thread.start()
+    
+    def stop(self):
+        """停止定期回报，并回报一次最终进度"""
+        self._stopped.set()
+        self.report()
+    
+    def report(self):
+        try:
+            # 任务重试时累加器可能重复计数，回报值不超过总数
+            processed = min(self.accumulator.value, self.total_records)
+            self.callback(processed, self.total_records)
+        except Exception as e:
+            logger.warning(f"回报处理进度失败: {str(e)}")
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+def process_and_write_to_mongodb(spark, parquet_path, hanlp_model=HANLP_MODEL, batch_size=500,
+                                 progress_callback=None, check_cancelled=None, timer=None, upload_id=None):
+    """
+    采用分布式读写架构处理导入的Parquet数据集并将结果写入MongoDB
+    
+    upload_id 不为空时写入每条评论，重试或取消任务时据此只清理本次上传写入的评论。
+    progress_callback(processed_records, total_records) 会在处理过程中定期调用，
+    每个批次完成后也会立即调用一次。
+    check_cancelled() 在每个批次开始前和批次出错时调用，任务已取消时抛出 JobCancelled。
+    timer 累计 dedup(comment_id去重)、batch_staging(按批次物化输入)、nlp(分析并缓存结果)、analysis_cache_write(写入分析缓存) 和 mongo_write(写入评论) 阶段的耗时。
+    timer 同时累计 input_rows、duplicate_comment_ids、cache_hits 和 analyzed_contents 统计数。
+    """
+    timer = timer or StageTimer()
+    reporter = None
+    batches_path = None
+    output_columns = [col(name) for name in COMMENT_COLUMNS]
+    if upload_id:
+        output_columns.append(lit(upload_id).alias("upload_id"))
     try:
         from pyspark.sql.window import Window
         from pyspark.sql.functions import row_number, monotonically_increasing_id, spark_partition_id, lit
+        from pyspark.sql.functions import count, countDistinct
         
-        hdfs_path = f"hdfs://master:9000/input_data/{input_file}"
-        logger.info(f"从HDFS读取数据: {hdfs_path}")
+        logger.info(f"从HDFS读取数据: {parquet_path}")
         
-        # 使用schema读取数据
-        df = read_csv_with_schema(spark, hdfs_path)
+        # 读取导入阶段生成的Parquet数据集
+        df = read_input_dataset(spark, parquet_path)
         
         # 确保基础必需的列存在且有值
         df = df.filter(
@@ -279,12 +679,31 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
             col("content").isNotNull()
         )
                 
-        total_records = df.count()
-        logger.info(f"有效记录数: {total_records}")
+        # 去重阶段：同一comment_id只保留一条，一次聚合同时得到去重前后的记录数
+        stage_start = time.time()
+        counts = df.agg(count(lit(1)).alias("rows"), countDistinct("comment_id").alias("comments")).first()
+        df = df.dropDuplicates(["comment_id"])
+        total_records = counts["comments"]
+        timer.add("dedup", time.time() - stage_start, total_records)
+        timer.count("input_rows", counts["rows"])
+        timer.count("duplicate_comment_ids", counts["rows"] - total_records)
+        logger.info(
+            f"有效记录数: {total_records}，重复comment_id的记录: {counts['rows'] - total_records} 条"
+        )
         
         if total_records == 0:
             logger.warning("没有找到有效记录")
             return
+        
+        # 按内容哈希批量关联跨任务的分析缓存，命中的评论不再重复分析
+        df = attach_cached_analysis(spark, df)
+        
+        # 每个任务使用独立的累加器统计已处理的记录数
+        progress = spark.sparkContext.accumulator(0)
+        process_text = create_process_text_udf(hanlp_model, progress)
+        if progress_callback:
+            reporter = ProgressReporter(progress, total_records, progress_callback)
+            reporter.start()
 
         # 计算合理的分区数
         available_cores = min(6, spark.sparkContext.defaultParallelism)
@@ -304,42 +723,20 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
             # 小数据集：直接基于分区并行处理
             logger.info("采用单批次分布式处理策略")
             
-            # 使用book_id作为分区键进行分区
-            df_partitioned = df.repartitionByRange(num_partitions, "book_id")
-            
-            # 处理文本内容 - 这一步在Spark Workers上并行执行
-            processed_df = df_partitioned.withColumn(
-                "processed_text", 
-                process_text(col("content"))
-            )
-            
-            # 选择并重命名列
-            result_df = processed_df.select(
-                col("book_id"),
-                col("comment_id"),
-                col("content"),
-                col("processed_text.jiagu_summary").alias("jiagu_summary"),
-                col("processed_text.keywords").alias("keywords"),
-                col("processed_text.labels").alias("labels"),
-                col("processed_text.sentiment").alias("sentiment")
-            )
-            
-            # 过滤掉空值
-            result_df = result_df.filter(
-                col("jiagu_summary").isNotNull() & 
-                col("sentiment").isNotNull()
-            )
+            # 未命中缓存的评论使用book_id作为分区键进行分区后分析
+            result_df = analyze_comments(df, process_text, num_partitions)
             
             # 缓存结果以避免重复计算
             result_df.cache()
             
-            # 获取处理后的记录数
-            processed_count = result_df.count()
+            # 获取处理后的记录数，并把新的分析结果写入缓存
+            processed_count, _ = finish_analysis(result_df, progress, timer)
             logger.info(f"处理完成，共 {processed_count} 条有效记录")
             
        
             logger.info("开始分布式写入MongoDB")
-            result_df.write \
+            stage_start = time.time()
+            result_df.select(*output_columns).write \
                 .format("mongodb") \
                 .mode("append") \
                 .option("database", MONGO_DATABASE) \
@@ -350,6 +747,7 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
                 .option("ordered", "false") \
                 .save()
             
+            timer.add("mongo_write", time.time() - stage_start, processed_count)
             logger.info(f"分布式写入完成，共写入 {processed_count} 条记录")
             
             # 释放缓存
@@ -366,61 +764,50 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
             # 计算批次数
             num_batches = (total_records + adjusted_batch_size - 1) // adjusted_batch_size
             
-            # 添加批次ID列
-            df_with_id = df.withColumn("id", monotonically_increasing_id())
+            # 添加批次ID列，并按批次分区物化一次：输入读取、去重和缓存关联只执行一次，
+            # 之后每个批次只读取自己的分区目录，不再为每个批次重新扫描整个输入
+            batches_path = get_batches_path(parquet_path)
+            stage_start = time.time()
+            df.withColumn("batch_id", monotonically_increasing_id() % lit(num_batches)) \
+                .write \
+                .mode("overwrite") \
+                .partitionBy("batch_id") \
+                .parquet(batches_path)
+            timer.add("batch_staging", time.time() - stage_start, total_records)
+            logger.info(f"已按 {num_batches} 个批次物化输入数据: {batches_path}")
+            df_batches = spark.read.parquet(batches_path)
             
             # 记录总处理和写入的记录数
             total_processed = 0
             
             for batch_num in range(num_batches):
+                if check_cancelled:
+                    check_cancelled()
                 logger.info(f"处理批次 {batch_num + 1}/{num_batches}")
                 
+                result_batch = None
                 try:
                     # 记录批处理开始时间
                     batch_start_time = time.time()
                     
-                    # 获取当前批次
-                    current_batch = df_with_id.filter(
-                        (col("id") % lit(num_batches)) == lit(batch_num)
-                    ).drop("id")
+                    # 获取当前批次，分区裁剪后只读取该批次的分区目录
+                    current_batch = df_batches.filter(col("batch_id") == lit(batch_num)).drop("batch_id")
                     
-                    # 使用book_id作为分区键进行分区
-                    batch_partitioned = current_batch.repartitionByRange(num_partitions, "book_id")
-                    
-                    # 处理文本内容 - 这一步在Spark Workers上并行执行
-                    processed_batch = batch_partitioned.withColumn(
-                        "processed_text", 
-                        process_text(col("content"))
-                    )
-                    
-                    # 选择并重命名列
-                    result_batch = processed_batch.select(
-                        col("book_id"),
-                        col("comment_id"),
-                        col("content"),
-                        col("processed_text.jiagu_summary").alias("jiagu_summary"),
-                        col("processed_text.keywords").alias("keywords"),
-                        col("processed_text.labels").alias("labels"),
-                        col("processed_text.sentiment").alias("sentiment")
-                    )
-                    
-                    # 过滤掉空值
-                    result_batch = result_batch.filter(
-                        col("jiagu_summary").isNotNull() & 
-                        col("sentiment").isNotNull()
-                    )
+                    # 未命中缓存的评论使用book_id作为分区键进行分区后分析
+                    result_batch = analyze_comments(current_batch, process_text, num_partitions)
                     
                     # 缓存结果以避免重复计算
                     result_batch.cache()
                     
-                    # 获取处理后的记录数
-                    batch_processed_count = result_batch.count()
+                    # 获取处理后的记录数，并把新的分析结果写入缓存
+                    batch_processed_count, _ = finish_analysis(result_batch, progress, timer)
                     logger.info(f"批次 {batch_num + 1} 处理完成，共 {batch_processed_count} 条有效记录")
                     
                     # 使用MongoDB Spark Connector进行分布式写入
                     # 这一步会在Spark Workers上并行执行，每个分区独立写入
                     logger.info(f"开始批次 {batch_num + 1} 分布式写入MongoDB")
-                    result_batch.write \
+                    stage_start = time.time()
+                    result_batch.select(*output_columns).write \
                         .format("mongodb") \
                         .mode("append") \
                         .option("database", MONGO_DATABASE) \
@@ -431,8 +818,12 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
                         .option("ordered", "false") \
                         .save()
                     
+                    timer.add("mongo_write", time.time() - stage_start, batch_processed_count)
+                    
                     # 更新总处理记录数
                     total_processed += batch_processed_count
+                    if reporter:
+                        reporter.report()
                     
                     # 释放缓存
                     result_batch.unpersist()
@@ -442,19 +833,22 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
                     batch_duration = batch_end_time - batch_start_time
                     logger.info(f"批次 {batch_num + 1} 完成，耗时: {batch_duration:.2f} 秒")
                     
-                    # 清理内存
+                    # 清理内存(只释放本任务的缓存，避免影响同一会话中并发的其他任务)
                     if batch_num % 2 == 0:
-                        spark.catalog.clearCache()
                         import gc
                         gc.collect()
-                        logger.info("已清理缓存和内存")
+                        logger.info("已清理内存")
                     
                 except Exception as e:
                     logger.error(f"处理批次 {batch_num + 1} 时出错: {str(e)}")
-                    spark.catalog.clearCache()
+                    if result_batch is not None:
+                        result_batch.unpersist()
                     import gc
                     gc.collect()
                     logger.info("发生错误，已清理缓存和内存")
+                    # 批次因任务取消而中断时不再继续后续批次
+                    if check_cancelled:
+                        check_cancelled()
                     continue
             
             logger.info(f"所有批次处理完成，共处理 {total_processed} 条记录")
@@ -464,85 +858,231 @@ def process_and_write_to_mongodb(spark, input_file, batch_size=500):
     except Exception as e:
         logger.error(f"处理失败: {str(e)}")
         raise
+    finally:
+        if reporter:
+            reporter.stop()
+        if batches_path:
+            remove_hdfs_path(spark, batches_path)
 
-# 主程序入口
-if __name__ == "__main__":
+def get_hdfs_file_size(spark, path):
+    """通过Hadoop FileSystem API获取文件大小(字节)"""
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs.getContentSummary(hadoop_path).getLength()
+
+def write_book_info(spark, parquet_path):
+    """处理书籍基本信息并写入MongoDB，返回写入的书籍数"""
     try:
-        if len(sys.argv) < 2:
-            logger.error("请提供输入文件名！使用方式: python algorithm.py <input_file> [batch_size]")
-            sys.exit(1)
-            
-        INPUT_FILE = sys.argv[1]
-        BATCH_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 500  # 默认批次大小
+        # 读取Parquet数据集
+        df = read_input_dataset(spark, parquet_path)
         
-        logger.info(f"开始处理文件: {INPUT_FILE}")
+        # 处理书籍信息
+        book_info_df = df.select(
+            "book_id",
+            "book_title",
+            "author",
+            "cover_url",
+            "publisher",
+            "pub_year",
+            "book_url"
+        ).dropDuplicates(["book_id"])
         
-        # 检查文件大小并调整处理策略
-        try:
-            from subprocess import check_output
-            hdfs_path = f"hdfs://master:9000/input_data/{INPUT_FILE}"
-            file_info = check_output(["hdfs", "dfs", "-du", "-h", hdfs_path]).decode('utf-8')
-            logger.info(f"文件信息: {file_info.strip()}")
+        # 按book_id更新或插入，任务重试时不会重复写入同一本书；
+        # 列较少的CSV中缺失的字段为null，忽略null值，不覆盖已有书籍的这些字段
+        book_info_df.write \
+            .format("mongodb") \
+            .mode("append") \
+            .option("database", MONGO_DATABASE) \
+            .option("collection", BOOK_INFO_COLLECTION) \
+            .option("writeConcern.w", "majority") \
+            .option("operationType", "update") \
+            .option("idFieldList", "book_id") \
+            .option("upsertDocument", "true") \
+            .option("ignoreNullValues", "true") \
+            .save()
             
-            # 如果文件超过100MB，调整批处理大小
-            if "M" in file_info and float(file_info.split()[0].replace('M', '')) > 100:
-                BATCH_SIZE = min(2000, BATCH_SIZE * 2)
-                logger.info(f"文件较大，调整批处理大小为: {BATCH_SIZE}")
-        except Exception as e:
-            logger.warning(f"获取文件信息失败: {str(e)}")
+        book_count = book_info_df.count()
+        logger.info(f"成功写入 {book_count} 条书籍信息到 {BOOK_INFO_COLLECTION}")
+        return book_count
+        
+    except Exception as e:
+        logger.error(f"处理书籍信息时出错: {str(e)}")
+        raise
+
+class AnalysisEngine:
+    """
+    常驻的分析引擎
+    
+    SparkSession和停用词在创建引擎时初始化一次，HanLP模型由各executor按需加载并常驻，
+    之后每个上传文件只需调用 process()，不再重复承担会话创建和模型加载的固定开销。
+    不会停止SparkSession，多个任务可以在同一个引擎中并发执行。
+    """
+    
+    def __init__(self, spark=None):
+        start_time = time.time()
+        self.spark = spark or create_spark_session()
+        
+        # 分发模型加载模块，executor在首次处理文本时从本地缓存加载模型，driver不持有模型
+        self.hanlp_model = HANLP_MODEL
+        self.spark.sparkContext.addPyFile(nlp_models.__file__)
+        self.stopwords_broadcast = self.spark.sparkContext.broadcast(load_stopwords(self.spark))
+        # 正在 process() 中的作业组，只有这些作业组的取消请求会被记录
+        self._active_groups = set()
+        self._cancelled_groups = set()
+        self._cancel_lock = threading.Lock()
+        
+        logger.info(f"分析引擎初始化完成，耗时: {time.time() - start_time:.2f} 秒")
+    
+    def process(self, input_file, batch_size=500, progress_callback=None, job_group=None,
+                stage_callback=None, upload_id=None, stats_callback=None):
+        """
+        处理一个上传文件：转换为Parquet、写入书籍信息、分析并写入评论
+        
+        Args:
+            input_file: HDFS输入目录中的文件名
+            batch_size: 大数据集分批处理时的批次大小
+            progress_callback: 可选，分析阶段定期以 (已处理记录数, 有效记录总数) 调用
+            job_group: 可选，本次处理所有Spark作业所属的作业组，用于 cancel()，同时作为FAIR调度池名和暂存数据路径的后缀
+            stage_callback: 可选，任务结束时(无论成功与否)以各阶段的耗时列表调用一次
+            upload_id: 可选，上传记录ID，写入每条评论的 upload_id 字段
+            stats_callback: 可选，任务结束时以 {input_rows, duplicate_comment_ids, cache_hits,
+                analyzed_contents} 调用一次，分别为输入记录数、重复comment_id数、命中缓存的评论数和实际分析的不同内容数
+        
+        Raises:
+            JobCancelled: 任务在处理过程中被取消
+        """
+        spark = self.spark
+        logger.info(f"开始处理文件: {input_file}")
+        if job_group:
+            with self._cancel_lock:
+                self._active_groups.add(job_group)
+            spark.sparkContext.setJobGroup(job_group, f"处理文件 {input_file}", interruptOnCancel=True)
+            # FAIR调度只在池之间公平分配资源，同一个池内仍是FIFO；每个任务使用独立的池，
+            # 大文件的作业不会占满所有executor而让后提交的小文件一直等待
+            spark.sparkContext.setLocalProperty("spark.scheduler.pool", f"upload_{job_group}")
+        check_cancelled = lambda: self._check_cancelled(job_group)
+        timer = StageTimer(stage_callback, stats_callback)
         
-        # 第一步：处理书籍基本信息
-        logger.info("=== 第一步：处理书籍基本信息 ===")
         try:
-            hdfs_path = f"hdfs://master:9000/input_data/{INPUT_FILE}"
-            
-            # 使用新的读取函数
-            df = read_csv_with_schema(spark, hdfs_path)
-            
-            # 处理书籍信息
-            book_info_df = df.select(
-                "book_id",
-                "book_title",
-                "author",
-                "cover_url",
-                "publisher",
-                "pub_year",
-                "book_url"
-            ).dropDuplicates(["book_id"])
-            
-            # 写入MongoDB
-            book_info_df.write \
-                .format("mongodb") \
-                .mode("append") \
-                .option("database", MONGO_DATABASE) \
-                .option("collection", BOOK_INFO_COLLECTION) \
-                .option("writeConcern.w", "majority") \
-                .option("replaceDocument", "false") \
-                .save()
+            # 检查文件大小并调整处理策略
+            try:
+                file_size = get_hdfs_file_size(spark, f"{INPUT_DIR}/{input_file}")
+                logger.info(f"文件大小: {file_size} 字节")
                 
-            logger.info(f"成功写入 {book_info_df.count()} 条书籍信息到 {BOOK_INFO_COLLECTION}")
+                # 如果文件超过100MB，调整批处理大小
+                if file_size > 100 * 1024 * 1024:
+                    batch_size = min(2000, batch_size * 2)
+                    logger.info(f"文件较大，调整批处理大小为: {batch_size}")
+            except Exception as e:
+                logger.warning(f"获取文件信息失败: {str(e)}")
             
-            # 清理缓存
-            spark.catalog.clearCache()
+            # 导入阶段：CSV只解析一次，转换为Parquet数据集
+            logger.info("=== 导入阶段：转换为Parquet数据集 ===")
+            stage_start = time.time()
+            parquet_path = convert_to_parquet(spark, input_file, job_group)
+            timer.add("schema_read", time.time() - stage_start)
             
-        except Exception as e:
-            logger.error(f"处理书籍信息时出错: {str(e)}")
+            try:
+                # 第一步：处理书籍基本信息
+                check_cancelled()
+                logger.info("=== 第一步：处理书籍基本信息 ===")
+                stage_start = time.time()
+                book_count = write_book_info(spark, parquet_path)
+                timer.add("book_info_write", time.time() - stage_start, book_count)
+                
+                # 第二步：处理评论数据
+                check_cancelled()
+                logger.info("\n=== 第二步：处理评论数据 ===")
+                process_and_write_to_mongodb(
+                    spark, parquet_path, self.hanlp_model, batch_size,
+                    progress_callback, check_cancelled, timer, upload_id
+                )
+                
+                logger.info("所有处理完成")
+            finally:
+                stage_start = time.time()
+                remove_hdfs_path(spark, parquet_path)
+                timer.add("cleanup", time.time() - stage_start)
+        
+        except JobCancelled:
             raise
-            
-        # 第二步：处理评论数据
-        logger.info("\n=== 第二步：处理评论数据 ===")
-        process_and_write_to_mongodb(spark, INPUT_FILE, BATCH_SIZE)
+        except Exception:
+            # 取消作业组会使正在运行的Spark作业抛出异常，统一转换为 JobCancelled
+            check_cancelled()
+            raise
+        finally:
+            timer.report()
+            if job_group:
+                spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+                with self._cancel_lock:
+                    self._active_groups.discard(job_group)
+                    self._cancelled_groups.discard(job_group)
+    
+    def cancel(self, job_group):
+        """
+        取消作业组中正在运行的Spark作业，并让对应任务在下一个检查点退出
+        
+        只记录正在处理的作业组，已结束或尚未开始的作业组不会在引擎中留下记录。
+        
+        Returns:
+            bool: 作业组正在处理并已取消时返回True，否则返回False
+        """
+        with self._cancel_lock:
+            if job_group not in self._active_groups:
+                logger.info(f"作业组 {job_group} 不在处理中，忽略取消请求")
+                return False
+            self._cancelled_groups.add(job_group)
+        self.spark.sparkContext.cancelJobGroup(job_group)
+        logger.info(f"已取消作业组: {job_group}")
+        return True
+    
+    def _check_cancelled(self, job_group):
+        with self._cancel_lock:
+            cancelled = job_group is not None and job_group in self._cancelled_groups
+        if cancelled:
+            raise JobCancelled(f"任务已取消: {job_group}")
+    
+    def stop(self):
+        """释放广播变量并停止SparkSession"""
+        try:
+            self.stopwords_broadcast.destroy()
+            self.spark.catalog.clearCache()
+            logger.info("已清理Spark缓存")
+        except Exception:
+            pass
+        self.spark.stop()
+
+# 进程内共享的引擎，首次使用时创建；导入本模块不会创建会话或加载模型
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """获取进程内共享的分析引擎，首次调用时初始化"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalysisEngine()
+        return _engine
+
+# 主程序入口
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        logger.error("请提供输入文件名！使用方式: python algorithm.py <input_file> [batch_size]")
+        sys.exit(1)
         
-        logger.info("所有处理完成")
+    INPUT_FILE = sys.argv[1]
+    BATCH_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 500  # 默认批次大小
+    
+    engine = None
+    try:
+        engine = AnalysisEngine()
+        engine.process(INPUT_FILE, BATCH_SIZE)
         
     except Exception as e:
         logger.error(f"程序运行失败: {str(e)}")
         sys.exit(1)
     finally:
         # 确保清理所有资源
-        try:
-            spark.catalog.clearCache()
-            logger.info("已清理Spark缓存")
-        except:
-            pass
-        spark.stop()
+        if engine is not None:
+            engine.stop()
@@ -1,4 +1,29 @@
 # 通用配置
+HDFS_BASE = "hdfs://master:9000"
+INPUT_DIR = f"{HDFS_BASE}/input_data"  # 上传文件所在目录
+PARQUET_DIR = f"{HDFS_BASE}/parquet_data"  # 导入阶段生成的Parquet数据集目录
+
+# NLP执行方式："pandas_udf" 按Arrow批次传输并批量调用HanLP；"udf" 逐行处理
+NLP_EXECUTION_MODE = "pandas_udf"
+NLP_ARROW_BATCH_SIZE = 256  # 每个Arrow批次(一次pandas UDF调用)的记录数
+HANLP_BATCH_SIZE = 32  # HanLP单次前向推理的句子数
+HANLP_MODEL = "CLOSE_TOK_POS_NER_SRL_DEP_SDP_CON_ELECTRA_SMALL_ZH"  # hanlp.pretrained.mtl 中的模型名
+HANLP_HOME = "/root/.hanlp"  # 各节点的本地模型缓存目录
+# 分析档位：只加载并运行标签提取实际用到的HanLP任务，其余任务头在加载后删除
+# full: 分词 + 词性 + 语义依存，标签包含语义依存短语；fast: 只做分词和词性，标签只包含关键词和名词短语
+HANLP_PROFILES = {
+    "full": ["tok/fine", "pos/ctb", "sdp"],
+    "fast": ["tok/fine", "pos/ctb"]
+}
+HANLP_PROFILE = "full"
+
+# 跨任务的评论分析结果缓存，按 分析版本 + 评论内容 的哈希查找，命中的评论不再重复分析
+ANALYSIS_CACHE_ENABLED = True
+ANALYSIS_CACHE_COLLECTION = "analysis_cache"
+ANALYSIS_VERSION = "1"  # 修改关键词/摘要/标签/情感的计算逻辑后递增，使旧的缓存结果失效
+ANALYSIS_CACHE_LOOKUP_BATCH = 10000  # 每次按主键查询缓存的内容键数
+ANALYSIS_CACHE_LOOKUP_MAX_KEYS = 100000  # 按主键查询的内容键上限，超过时改为读取当前版本的整个缓存做关联
+
 MONGO_USER = "root"
 MONGO_PASSWORD = "example"
 MONGO_HOST = "mongodb-primary"  # 使用容器名作为主机名
@@ -0,0 +1,52 @@
+"""
+executor端按需加载的NLP模型
+
+本模块通过 SparkContext.addPyFile 分发到各个executor，模型在每个Python worker进程中
+首次使用时从本地模型缓存加载一次，之后在该进程处理的所有任务之间复用，
+不再由driver加载模型并通过广播变量序列化分发。
+
+本模块不依赖算法目录下的 config，可以在driver、executor和Web进程中直接导入。
+"""
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 每个Python worker进程内已加载的模型，键为模型名
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_hanlp(model_name, hanlp_home=None, tasks=None):
+    """
+    获取当前进程内的HanLP模型，首次调用时加载
+
+    Args:
+        model_name: hanlp.pretrained.mtl 中的预训练模型名，如 CLOSE_TOK_POS_NER_SRL_DEP_SDP_CON_ELECTRA_SMALL_ZH
+        hanlp_home: 可选，本地模型缓存目录，已下载的模型不会重复下载
+        tasks: 可选，需要保留的任务，其余任务头在加载后删除以减少推理时间和内存
+
+    Returns:
+        HanLP多任务模型
+    """
+    key = (model_name, tuple(tasks) if tasks else None)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        if key not in _models:
+            if hanlp_home:
+                # HanLP在导入时读取缓存目录，需要在首次导入前设置
+                os.environ.setdefault('HANLP_HOME', hanlp_home)
+            import hanlp
+
+            logger.info(f"进程 {os.getpid()} 加载HanLP模型: {model_name}, 保留任务: {tasks or '全部'}")
+            model = hanlp.load(getattr(hanlp.pretrained.mtl, model_name))
+            if tasks:
+                for task in list(model.tasks):
+                    if task not in tasks:
+                        del model[task]
+            _models[key] = model
+        return _models[key]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 算法模块以脚本目录为导入根目录(import config / nlp_models)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
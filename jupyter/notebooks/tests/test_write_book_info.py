@@ -0,0 +1,86 @@
+"""
+write_book_info 的集成测试
+
+需要本地PySpark(首次运行时下载MongoDB Spark Connector)和一个可写的MongoDB，
+通过环境变量 TEST_MONGO_URI 指定，未设置时跳过。测试使用独立的数据库，不会写入业务数据。
+"""
+import os
+import uuid
+
+import pytest
+
+pytest.importorskip("pyspark")
+pymongo = pytest.importorskip("pymongo")
+
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI")
+pytestmark = pytest.mark.skipif(not TEST_MONGO_URI, reason="未设置 TEST_MONGO_URI")
+
+
+@pytest.fixture(scope="module")
+def spark():
+    from pyspark.sql import SparkSession
+
+    session = SparkSession.builder \
+        .master("local[2]") \
+        .appName("test_write_book_info") \
+        .config("spark.sql.shuffle.partitions", "2") \
+        .config("spark.mongodb.write.connection.uri", TEST_MONGO_URI) \
+        .config("spark.mongodb.read.connection.uri", TEST_MONGO_URI) \
+        .config("spark.jars.packages", "org.mongodb.spark:mongo-spark-connector_2.12:10.4.0") \
+        .getOrCreate()
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def books(monkeypatch):
+    import algorithm
+
+    database = f"test_book_system_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(algorithm, "MONGO_DATABASE", database)
+    client = pymongo.MongoClient(TEST_MONGO_URI)
+    yield client[database][algorithm.BOOK_INFO_COLLECTION]
+    client.drop_database(database)
+    client.close()
+
+
+def write_csv_dataset(spark, tmp_path, name, content):
+    """把CSV内容按导入阶段的方式转换为Parquet数据集，返回数据集路径"""
+    import algorithm
+
+    csv_path = tmp_path / f"{name}.csv"
+    csv_path.write_text(content, encoding="utf-8")
+    parquet_path = str(tmp_path / f"{name}.parquet")
+    algorithm.read_csv_with_schema(spark, str(csv_path)).write.mode("overwrite").parquet(parquet_path)
+    return parquet_path
+
+
+def test_reingest_with_fewer_columns_keeps_existing_fields(spark, books, tmp_path):
+    import algorithm
+
+    full = write_csv_dataset(spark, tmp_path, "full", (
+        "book_id,book_title,author,cover_url,publisher,pub_year,book_url,comment_id,user,content,rating\n"
+        "1,活着,余华,http://img/1.jpg,作家出版社,2012,http://book/1,c1,u1,很好,5\n"
+    ))
+    assert algorithm.write_book_info(spark, full) == 1
+
+    # 只包含必需列的CSV再次导入同一本书，并更新了书名
+    minimal = write_csv_dataset(spark, tmp_path, "minimal", (
+        "book_id,book_title,comment_id,content\n"
+        "1,活着(新版),c2,还不错\n"
+        "2,许三观卖血记,c3,感人\n"
+    ))
+    assert algorithm.write_book_info(spark, minimal) == 2
+
+    book = books.find_one({"book_id": "1"})
+    assert book["book_title"] == "活着(新版)"
+    assert book["author"] == "余华"
+    assert book["cover_url"] == "http://img/1.jpg"
+    assert book["publisher"] == "作家出版社"
+    assert book["pub_year"] == "2012"
+    assert book["book_url"] == "http://book/1"
+    assert books.count_documents({"book_id": "1"}) == 1
+
+    new_book = books.find_one({"book_id": "2"})
+    assert new_book["book_title"] == "许三观卖血记"
+    assert "author" not in new_book